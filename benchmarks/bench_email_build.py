@@ -0,0 +1,74 @@
+"""Benchmark for building result emails.
+
+Compares the original approach (render_template for both bodies, and reading the logo from disk
+for every message) with NotificationService.build_result_email, which fills in a pre-rendered
+skeleton.  Run from the root of the project with:
+
+    python -m benchmarks.bench_email_build [samples]
+"""
+import sys
+import time
+from email.header import Header
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from os.path import join
+
+from flask import render_template
+
+from communicator import app
+from communicator.models import Sample
+from communicator.services.notification_service import NotificationService
+
+
+def original_build(notifier, sample):
+    link = notifier.get_link(sample)
+    tracking_code = notifier._tracking_code()
+    text_body = render_template("emails/result_email.txt", link=link, base_url=notifier.URL_ROOT,
+                                sample=sample, tracking_code=tracking_code)
+    html_body = render_template("emails/result_email.html", link=link, base_url=notifier.URL_ROOT,
+                                sample=sample, tracking_code=tracking_code)
+    msgRoot = MIMEMultipart('related')
+    msgRoot.set_charset('utf8')
+    msgRoot['Subject'] = Header("UVA: BE SAFE Notification".encode('utf-8'), 'utf-8').encode()
+    msgRoot['From'] = notifier.sender
+    msgRoot['To'] = sample.email
+    msgRoot.preamble = 'This is a multi-part message in MIME format.'
+    msgAlternative = MIMEMultipart('alternative')
+    msgRoot.attach(msgAlternative)
+    msgAlternative.attach(MIMEText(text_body, 'plain', _charset='UTF-8'))
+    msgAlternative.attach(MIMEText(html_body, 'html', _charset='UTF-8'))
+    fp = open(join(app.root_path, 'static', 'assets', 'img', 'brand', 'uva_logo.png'), 'rb')
+    msgImage = MIMEImage(fp.read())
+    fp.close()
+    msgImage.add_header('Content-ID', '<logo>')
+    msgRoot.attach(msgImage)
+    return msgRoot
+
+
+def messages_per_second(build, samples, serialize=False):
+    start = time.perf_counter()
+    for sample in samples:
+        message = build(sample)
+        if serialize:
+            message.as_bytes()
+    return len(samples) / (time.perf_counter() - start)
+
+
+def main(count=10000):
+    samples = [Sample(barcode=str(i), email=f"student{i}@virginia.edu", result_code=str(1000000000 + i))
+               for i in range(count)]
+    with app.app_context():
+        notifier = NotificationService(app)
+        print(f"Built {count} result emails")
+        for serialize in (False, True):
+            before = messages_per_second(lambda s: original_build(notifier, s), samples, serialize)
+            after = messages_per_second(notifier.build_result_email, samples, serialize)
+            label = " + as_bytes" if serialize else ""
+            print(f"  {'render_template + logo per message' + label:<52} {before:10,.0f} messages/sec")
+            print(f"  {'NotificationService.build_result_email' + label:<52} {after:10,.0f} messages/sec  "
+                  f"({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
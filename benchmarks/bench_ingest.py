@@ -0,0 +1,136 @@
+"""Benchmarks the IVY ingest pipeline against a local Postgres database.
+
+Generates IVY files (see benchmarks.generate_ivy_data) into a temporary directory, and times
+each stage of the import:
+
+  * IvyService.samples_from_ivy_file - parsing the files into Sample records
+  * admin.load_local_files - the import the scheduler runs, from an empty database, streaming each
+    file in chunks, parsing files in parallel (IVY_IMPORT_WORKERS), and through COPY
+    (IVY_COPY_THRESHOLD_ROWS)
+  * SampleService.add_or_update_records - loading samples that are already there, as happens when
+    IVY re-delivers a file
+
+Every stage runs in its own process, so the peak RSS reported is that stage's alone (including
+any worker processes it starts).
+
+Run from the root of the project, against a scratch database, with:
+
+    DB_NAME=communicator_bench python -m benchmarks.bench_ingest [--rows 100000] [--files 4]
+
+The database must already be migrated (flask db upgrade).  Only samples and files created by
+the benchmark (those from files named bench_*) are removed, before and after each stage.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate_ivy_data import write_ivy_files
+
+PREFIX = 'bench'
+
+# name, the stage function, and the configuration it runs with.
+STAGES = [
+    ('samples_from_ivy_file', 'parse', {}),
+    ('load_local_files (chunked)', 'load', {'IVY_IMPORT_WORKERS': 1, 'IVY_COPY_THRESHOLD_ROWS': 0}),
+    ('load_local_files (parallel)', 'load', {'IVY_IMPORT_WORKERS': 4, 'IVY_COPY_THRESHOLD_ROWS': 0}),
+    ('load_local_files (copy)', 'load', {'IVY_IMPORT_WORKERS': 1, 'IVY_COPY_THRESHOLD_ROWS': 1}),
+    ('add_or_update_records (again)', 'reload', {}),
+]
+
+
+def peak_rss_mb():
+    """The peak resident set size of this process, or of the largest of its worker processes
+    (ru_maxrss is in KB on Linux)."""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def clean_up():
+    from communicator import db
+    from communicator.models import Sample
+    from communicator.models.ivy_file import IvyFile
+    db.session.rollback()
+    db.session.query(Sample).filter(Sample.ivy_file.like(f'{PREFIX}_%')).delete(synchronize_session=False)
+    db.session.query(IvyFile).filter(IvyFile.file_name.like(f'{PREFIX}_%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def parse(import_dir):
+    from communicator.services.ivy_service import IvyService
+    start = time.perf_counter()
+    for file_name in IvyService().list_files():
+        IvyService.samples_from_ivy_file(import_dir, file_name)
+    return time.perf_counter() - start, ''
+
+
+def load(import_dir):
+    from communicator.api import admin
+    start = time.perf_counter()
+    admin.load_local_files()
+    return time.perf_counter() - start, ''
+
+
+def reload(import_dir):
+    from communicator.api import admin
+    from communicator.services.ivy_service import IvyService
+    from communicator.services.sample_service import SampleService
+    admin.load_local_files()
+    samples = [s for f in IvyService().list_files() for s in IvyService.samples_from_ivy_file(import_dir, f)]
+    start = time.perf_counter()
+    counts = SampleService().add_or_update_records(samples)
+    return time.perf_counter() - start, str(counts)
+
+
+def run_stage(stage, import_dir, config):
+    """Runs in the child process, printing the results as JSON."""
+    from communicator import app
+    with app.app_context():
+        app.config['IVY_IMPORT_DIR'] = import_dir
+        app.config['DELETE_IVY_FILES'] = False
+        app.config.update(config)
+        clean_up()
+        try:
+            seconds, extra = globals()[stage](import_dir)
+        finally:
+            clean_up()
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'extra': extra}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IVY import.")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--duplicates', type=float, default=0.05)
+    parser.add_argument('--bad-dates', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args.stage, args.directory, json.loads(args.config))
+        return
+
+    with tempfile.TemporaryDirectory() as import_dir:
+        start = time.perf_counter()
+        write_ivy_files(import_dir, args.rows, args.files, prefix=PREFIX, seed=args.seed,
+                        duplicates=args.duplicates, bad_dates=args.bad_dates)
+        print(f"Generated {args.rows:,} rows in {args.files} file(s) in {time.perf_counter() - start:.2f}s")
+
+        for name, stage, config in STAGES:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_ingest', '--stage', stage,
+                                     '--directory', import_dir, '--config', json.dumps(config)],
+                                    stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"  {name:<32} {args.rows:>10,} rows {result['seconds']:8.2f}s "
+                  f"{args.rows / result['seconds']:12,.0f} rows/sec "
+                  f"peak RSS {result['peak_rss_mb']:8,.0f} MB  {result['extra']}")
+
+
+if __name__ == '__main__':
+    main()
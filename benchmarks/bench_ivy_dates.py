@@ -0,0 +1,51 @@
+"""Micro-benchmark for parsing the 'Test Date Time' values in IVY records.
+
+Compares the original approach (dateutil's general purpose parser, and a timezone lookup for
+every row) with IvyService.parse_test_date.  Run from the root of the project with:
+
+    python -m benchmarks.bench_ivy_dates [rows]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil import parser
+
+from communicator.services.ivy_service import IvyService
+
+
+def original_parse(value):
+    date = parser.parse(value)
+    tz = pytz.timezone("America/New_York")
+    return tz.localize(date)
+
+
+def test_dates(rows, days=7):
+    """Test times spread over the given number of days, like a typical backlog of IVY files."""
+    start = datetime(2020, 10, 28)  # Spans the end of daylight saving time.
+    return [(start + timedelta(minutes=random.randint(0, 60 * 24 * days))).strftime('%Y%m%d%H%M')
+            for _ in range(rows)]
+
+
+def rows_per_second(parse, values):
+    start = time.perf_counter()
+    for value in values:
+        parse(value)
+    return len(values) / (time.perf_counter() - start)
+
+
+def main(rows=100000):
+    values = test_dates(rows)
+    assert all(original_parse(v).utcoffset() == IvyService.parse_test_date(v).utcoffset() and
+               original_parse(v) == IvyService.parse_test_date(v) for v in values)
+    before = rows_per_second(original_parse, values)
+    after = rows_per_second(IvyService.parse_test_date, values)
+    print(f"Parsed {rows} 'Test Date Time' values")
+    print(f"  dateutil + pytz.timezone per row: {before:12,.0f} rows/sec")
+    print(f"  IvyService.parse_test_date:       {after:12,.0f} rows/sec  ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
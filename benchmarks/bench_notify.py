@@ -0,0 +1,217 @@
+"""Benchmarks sending result emails, against a local SMTP sink, and a local Postgres database.
+
+In TESTING mode NotificationService never goes near the wire, so this runs the real thing,
+admin._notify_by_email, over a synthetic backlog of samples waiting to be notified, with the
+messages going to an aiosmtpd server on this machine, that can be made to:
+
+  * take a while to accept each message (--latency, in seconds)
+  * turn some messages away with a 451, as a relay does when we go too fast (--throttle, the
+    fraction of messages)
+  * drop the connection part way through a message (--disconnect, the fraction of messages)
+
+With none of these given, it runs each of the SCENARIOS below in turn.  For each it reports
+messages sent per second, the p50 / p99 time to send a message (including any reconnects, see
+SmtpConnectionPool.send), and the time spent in the database per message.
+
+Run from the root of the project, against a scratch database, with:
+
+    DB_NAME=communicator_bench python -m benchmarks.bench_notify [--samples 2000] [--outbox]
+
+The database must already be migrated (flask db upgrade).  Only samples created by the benchmark
+(those with barcodes starting bench-) are removed, before and after each scenario, along with
+the state of the 'smtp' rate limiter.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import event
+
+PREFIX = 'bench-'
+
+# name, and the behaviour of the SMTP sink.
+SCENARIOS = [
+    ('clean', {}),
+    ('20ms latency', {'latency': 0.02}),
+    ('20ms latency, 1% 451s', {'latency': 0.02, 'throttle': 0.01}),
+    ('20ms latency, 1% disconnects', {'latency': 0.02, 'disconnect': 0.01}),
+]
+
+
+class SinkHandler(object):
+    """Accepts every message, after 'latency' seconds, except those it throttles or hangs up on."""
+
+    def __init__(self, latency=0, throttle=0, disconnect=0, seed=42):
+        self.latency = latency
+        self.throttle = throttle
+        self.disconnect = disconnect
+        self.random = random.Random(seed)
+        self.received = 0
+        self.throttled = 0
+        self.disconnected = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = self.random.random()
+        if roll < self.throttle:
+            self.throttled += 1
+            return '451 4.7.0 Too many messages, slow down'
+        if roll < self.throttle + self.disconnect:
+            self.disconnected += 1
+            server.transport.close()
+            return '421 4.4.2 Connection dropped'
+        self.received += 1
+        return '250 OK'
+
+
+class DatabaseTimer(object):
+    """Adds up the time spent running statements, on any connection from the engine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.seconds = 0
+        self.statements = 0
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.before)
+        event.listen(self.engine, 'after_cursor_execute', self.after)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute', self.before)
+        event.remove(self.engine, 'after_cursor_execute', self.after)
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('bench_started', []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['bench_started'].pop()
+        with self.lock:
+            self.seconds += seconds
+            self.statements += 1
+
+
+def clean_up():
+    from communicator import db
+    from communicator.models import Sample
+    from communicator.models.notification import Notification
+    from communicator.models.rate_limit_state import RateLimitState
+    db.session.rollback()
+    db.session.query(Notification).filter(Notification.sample_barcode.like(f'{PREFIX}%'))\
+        .delete(synchronize_session=False)
+    db.session.query(Sample).filter(Sample.barcode.like(f'{PREFIX}%')).delete(synchronize_session=False)
+    db.session.query(RateLimitState).filter(RateLimitState.name == 'smtp').delete(synchronize_session=False)
+    db.session.commit()
+
+
+def add_backlog(count):
+    from communicator import db
+    from communicator.models import Sample
+    now = datetime.utcnow()
+    db.session.execute(Sample.__table__.insert(), [
+        {'barcode': f'{PREFIX}{i:08}', 'email': f'student{i}@example.com', 'result_code': str(1000000000 + i),
+         'ivy_file': 'bench_notify', 'created_on': now, 'last_modified': now,
+         'email_notified': False, 'text_notified': False, 'email_failed': False, 'text_failed': False}
+        for i in range(count)])
+    db.session.commit()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def run_scenario(samples, sink):
+    """Sends the backlog to the sink, returning the wall time, send latencies, and database timer."""
+    from communicator import app, db
+    from communicator.api import admin
+    from communicator.services.smtp_pool import SmtpConnectionPool
+
+    clean_up()
+    add_backlog(samples)
+    SmtpConnectionPool._shared = None  # A fresh pool, with no connections from the last scenario.
+    latencies = []
+    send = SmtpConnectionPool.send
+
+    def timed_send(pool, deliver):
+        start = time.perf_counter()
+        try:
+            return send(pool, deliver)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        with patch.object(SmtpConnectionPool, 'send', timed_send), DatabaseTimer(db.engine) as timer:
+            start = time.perf_counter()
+            admin._notify_by_email()
+            seconds = time.perf_counter() - start
+        SmtpConnectionPool.shared(None, app.config).close()
+    finally:
+        clean_up()
+    return seconds, latencies, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sending result emails.")
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--latency', type=float, help="Seconds the sink takes to accept each message.")
+    parser.add_argument('--throttle', type=float, help="The fraction of messages turned away with a 451.")
+    parser.add_argument('--disconnect', type=float, help="The fraction of messages the sink hangs up on.")
+    parser.add_argument('--pool-size', type=int, default=4, help="MAIL_POOL_SIZE")
+    parser.add_argument('--rate', type=float, default=0, help="MAIL_RATE_PER_SECOND, 0 for no limit.")
+    parser.add_argument('--min-rate', type=float, default=20, help="MAIL_RATE_MIN_PER_SECOND")
+    parser.add_argument('--backoff', type=float, default=0.1, help="MAIL_BACKOFF_SECONDS")
+    parser.add_argument('--outbox', action='store_true', help="Lease the samples from the notification outbox.")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.latency is not None or args.throttle is not None or args.disconnect is not None:
+        scenarios = [('custom', {'latency': args.latency or 0, 'throttle': args.throttle or 0,
+                                 'disconnect': args.disconnect or 0})]
+
+    from communicator import app
+    with app.app_context():
+        for name, behaviour in scenarios:
+            sink = SinkHandler(**behaviour)
+            controller = Controller(sink, hostname='127.0.0.1', port=free_port())
+            controller.start()
+            try:
+                app.config.update({
+                    'TESTING': False,
+                    'MAIL_SERVER': '127.0.0.1',
+                    'MAIL_PORT': controller.port,
+                    'MAIL_USE_TLS': False,
+                    'MAIL_USERNAME': '',
+                    'MAIL_POOL_SIZE': args.pool_size,
+                    'MAIL_RATE_PER_SECOND': args.rate,
+                    'MAIL_RATE_PER_HOUR': 0,
+                    'MAIL_RATE_MIN_PER_SECOND': args.min_rate,
+                    'MAIL_BACKOFF_SECONDS': args.backoff,
+                    'MAIL_MAX_THROTTLES': args.samples,
+                    'NOTIFICATION_OUTBOX': args.outbox,
+                })
+                seconds, latencies, timer = run_scenario(args.samples, sink)
+            finally:
+                controller.stop()
+            print(f"  {name:<30} {sink.received:>7,} sent {seconds:8.2f}s {sink.received / seconds:9,.1f} msgs/sec "
+                  f"p50 {percentile(latencies, 0.5) * 1000:7.1f}ms p99 {percentile(latencies, 0.99) * 1000:7.1f}ms "
+                  f"db {timer.seconds * 1000 / max(1, sink.received):6.2f}ms/msg ({timer.statements:,} statements) "
+                  f"{sink.throttled} throttled, {sink.disconnected} disconnected")
+
+
+if __name__ == '__main__':
+    main()
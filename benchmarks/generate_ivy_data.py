@@ -0,0 +1,91 @@
+"""Generates realistic, pipe delimited IVY files for benchmarking the import.
+
+    python -m benchmarks.generate_ivy_data output_dir [--rows 1000000] [--files 1]
+        [--duplicates 0.05] [--bad-dates 0.001] [--seed 42]
+
+Rows are written as they are generated, so millions of rows can be produced without holding
+them in memory.  A 'duplicate' re-delivers an earlier barcode (as happens when IVY sends a
+result after first sending the sample without one), and a 'bad date' has a Test Date Time that
+can't be parsed.
+"""
+import argparse
+import random
+import string
+from datetime import datetime, timedelta
+from os.path import join
+
+HEADER = ['Student ID', 'Student Cellphone', 'Student Email', 'Test Date Time', 'Test Kiosk Loc',
+          'Test Result Code', 'Test Bar Code']
+
+BAD_DATES = ['', 'unknown', '2020-13-45', '202013451299']
+
+LOCATIONS = [4321, 4322, 4323, 4324, 4325, 4326]
+
+
+def random_row(rng, start, days):
+    student_id = str(rng.randint(100000000, 999999999))
+    computing_id = ''.join(rng.choices(string.ascii_lowercase, k=3)) + str(rng.randint(1, 9)) + \
+        rng.choice(string.ascii_lowercase)
+    date = (start + timedelta(minutes=rng.randint(0, 60 * 24 * days))).strftime('%Y%m%d%H%M')
+    location = str(rng.choice(LOCATIONS))
+    phone = f"{rng.randint(200, 999)}/{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"
+    return [student_id, phone, f"{computing_id}@virginia.edu", date, location, '',
+            f"{student_id}-{computing_id[:3].upper()}-{date}-{location}"]
+
+
+def generate_rows(rows, duplicates=0.05, bad_dates=0.001, seed=None, start=datetime(2020, 9, 1), days=7):
+    """Generates 'rows' IVY records (as lists of values, in the order of HEADER)."""
+    rng = random.Random(seed)
+    recent = []  # Previous rows that are likely to be re-delivered.
+    for _ in range(rows):
+        if recent and rng.random() < duplicates:
+            row = list(rng.choice(recent))
+            row[5] = str(rng.randint(1000000000, 9999999999))  # Typically the result came in.
+        else:
+            row = random_row(rng, start, days)
+            if len(recent) < 10000:
+                recent.append(row)
+            else:
+                recent[rng.randrange(len(recent))] = row
+        if rng.random() < bad_dates:
+            row = list(row)
+            row[3] = rng.choice(BAD_DATES)
+        yield row
+
+
+def write_ivy_file(file_path, rows, **kwargs):
+    """Writes an IVY file with the given number of generated rows (see generate_rows)."""
+    with open(file_path, 'w') as ivy_file:
+        ivy_file.write('|'.join(HEADER) + '\n')
+        for row in generate_rows(rows, **kwargs):
+            ivy_file.write('|'.join(row) + '\n')
+
+
+def write_ivy_files(directory, rows, files=1, prefix='bench', seed=None, **kwargs):
+    """Spreads 'rows' over the given number of files in the directory, returning their names."""
+    file_names = []
+    for i in range(files):
+        file_name = f"{prefix}_{i + 1}.csv"
+        file_seed = None if seed is None else seed + i
+        write_ivy_file(join(directory, file_name), rows // files + (1 if i < rows % files else 0),
+                       seed=file_seed, **kwargs)
+        file_names.append(file_name)
+    return file_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate IVY files for benchmarking.")
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--files', type=int, default=1)
+    parser.add_argument('--duplicates', type=float, default=0.05, help="ratio of re-delivered barcodes")
+    parser.add_argument('--bad-dates', type=float, default=0.001, help="ratio of unparsable dates")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    for file_name in write_ivy_files(args.directory, args.rows, args.files, seed=args.seed,
+                                     duplicates=args.duplicates, bad_dates=args.bad_dates):
+        print(join(args.directory, file_name))
+
+
+if __name__ == '__main__':
+    main()
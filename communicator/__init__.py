@@ -3,6 +3,7 @@ import logging
 import os
 from functools import wraps
 
+import click
 import connexion
 import sentry_sdk
 from flask import redirect, flash, abort, Response
@@ -152,3 +153,32 @@ def transfer():
     ivy_service = IvyService()
     ivy_service.request_transfer()
 
+
+@app.cli.command()
+@click.argument('file_name')
+def copy_import(file_name):
+    """Loads a (large) file from the IVY_IMPORT_DIR with Postgres' COPY."""
+    from communicator.api import admin
+    admin.copy_local_file(file_name)
+
+
+@app.cli.command()
+def scheduled_update():
+    """Runs the scheduler's update (loading any new files, and sending emails) now, and prints the
+    notification metrics."""
+    from communicator.scheduler import update
+    from communicator.services.metrics import metrics
+    update()
+    print(metrics.report())
+
+
+@app.cli.command()
+@click.option('--file-name', help="Only notify samples from this IVY file.")
+@click.option('--retry', is_flag=True, help="Try again those that failed last time.")
+def notify(file_name, retry):
+    """Sends any emails and texts waiting to go out, and prints the notification metrics."""
+    from communicator.api import admin
+    from communicator.services.metrics import metrics
+    admin._notify_by_email(file_name, retry)
+    admin._notify_by_text(file_name, retry)
+    print(metrics.report())
@@ -1,19 +1,28 @@
 import smtplib
+import time
 from datetime import datetime, timedelta
 from sqlalchemy import and_, or_
 
 from communicator import db, app, executor
 from communicator.models import Sample
+from communicator.models.sample import normalize_phone
 from communicator.models.invitation import Invitation
 from communicator.models.notification import Notification, EMAIL_TYPE, TEXT_TYPE
 from communicator.models import Sample, SampleSchema
 from communicator.models import IvyFile, IvyFileSchema
 from communicator.models import Deposit, DepositSchema
 from communicator.models.user import UserSchema
+from communicator.services.copy_import_service import CopyImportService
+from communicator.services.email_dispatcher import EmailDispatcher
 from communicator.services.ivy_service import IvyService
+from communicator.services.latency_service import LatencyService
+from communicator.services.metrics import metrics
+from communicator.services.notification_recorder import NotificationRecorder
 from communicator.services.notification_service import NotificationService
-from communicator.services.sample_service import SampleService
-from time import sleep
+from communicator.services.outbox_service import OutboxService
+from communicator.services.rate_controller import AdaptiveRateController
+from communicator.services.sample_service import SampleService, UpsertCounts
+from communicator.services.sms_dispatcher import SmsDispatcher
 
 from communicator.services.user_service import UserService
 
@@ -77,6 +86,9 @@ def add_sample(body):
     loc_code = body['location']
     sample.location, sample.station = int(loc_code[:2]), int(loc_code[2:])
 
+    sample.phone = body.get('phone')
+    sample.phone_e164, sample.phone_valid = normalize_phone(sample.phone)
+
     SampleService().add_or_update_records([sample])
 
 
@@ -190,19 +202,86 @@ def _update_data():
 
 def load_local_files():
     """
-    Just process any files that are local to the system.
+    Just process any files that are local to the system.  Files are streamed into the database
+    a chunk at a time, so that large files (or a large backlog of files) don't exhaust memory.
+    If IVY_IMPORT_WORKERS is set, and there are several files waiting, they are parsed in parallel.
+    Very large files are loaded with Postgres' COPY (see IVY_COPY_THRESHOLD_ROWS).
+    Files that were already imported, and haven't changed, are skipped.
     """
     ivy_service = IvyService()
-    files, samples = ivy_service.load_directory()
-    SampleService().add_or_update_records(samples)
-    for file in files:
-        db.session.add(file)
-        db.session.commit()
-        if app.config['DELETE_IVY_FILES']:
-            ivy_service.delete_file(file.file_name)
+    app.logger.info(f'Loading directory {ivy_service.path}')
+    ivy_files = []
+    for ivy_file in ivy_service.files_to_import():
+        if _use_copy(ivy_service, ivy_file):
+            _copy_local_file(ivy_service, ivy_file)
         else:
-            app.logger.info("Not Deleting Files, per DELETE_IVY_FILES flag")
+            ivy_files.append(ivy_file)
+
+    chunk_size = app.config['IVY_IMPORT_CHUNK_SIZE']
+    workers = app.config['IVY_IMPORT_WORKERS']
+    if workers > 1 and len(ivy_files) > 1:
+        files_by_name = {ivy_file.file_name: ivy_file for ivy_file in ivy_files}
+        for file_name, rows in ivy_service.parse_files_in_parallel(list(files_by_name), workers):
+            _load_local_file(ivy_service, files_by_name[file_name],
+                             IvyService.chunks_from_rows(rows, file_name, chunk_size))
+    else:
+        for ivy_file in ivy_files:
+            _load_local_file(ivy_service, ivy_file,
+                             IvyService.chunks_from_ivy_file(ivy_service.path, ivy_file.file_name, chunk_size))
+    db.session.commit()  # Records any unchanged or duplicate files that were found.
+
+
+def _load_local_file(ivy_service, ivy_file, chunks):
+    """Loads a single file, committing each chunk of samples along with the progress recorded on
+    the file's IvyFile record."""
+    sample_service = SampleService()
+    counts = UpsertCounts()
+    for chunk in chunks:
+        ivy_file.sample_count += len(chunk)
+        db.session.add(ivy_file)
+        counts += sample_service.add_or_update_records(chunk)
+        app.logger.info(f'Loaded {ivy_file.sample_count} samples from file {ivy_file.file_name}')
+    _file_loaded(ivy_service, ivy_file, counts)
+
+
+def _use_copy(ivy_service, ivy_file):
+    threshold = app.config['IVY_COPY_THRESHOLD_ROWS']
+    return threshold > 0 and db.engine.dialect.name == 'postgresql' \
+        and ivy_service.count_rows(ivy_file.file_name) > threshold
+
+
+def _copy_local_file(ivy_service, ivy_file):
+    """Loads a single file in one transaction using Postgres' COPY."""
+    counts = CopyImportService().import_file(ivy_service.path, ivy_file.file_name)
+    ivy_file.sample_count = counts.total
+    _file_loaded(ivy_service, ivy_file, counts)
+
+
+def copy_local_file(file_name):
+    """Loads the given file from the IVY_IMPORT_DIR using Postgres' COPY, whether or not it was
+    imported before, useful for large backfills."""
+    ivy_service = IvyService()
+    ivy_file = db.session.query(IvyFile).filter(IvyFile.file_name == file_name).first()
+    if not ivy_file:
+        ivy_file = IvyFile(file_name=file_name)
+    ivy_service.update_manifest(ivy_file)
+    ivy_file.date_added = datetime.now()
+    ivy_file.duplicate_of = None
+    _copy_local_file(ivy_service, ivy_file)
+
+
+def _file_loaded(ivy_service, ivy_file, counts):
+    ivy_file.date_completed = datetime.now()
+    db.session.add(ivy_file)
+    if app.config['NOTIFICATION_OUTBOX']:
+        OutboxService.enqueue(EMAIL_TYPE, ivy_file.file_name)
+        OutboxService.enqueue(TEXT_TYPE, ivy_file.file_name, not_before=NotificationService.text_window_opens())
     db.session.commit()
+    app.logger.info(f'Loaded {ivy_file.file_name}: {counts}')
+    if app.config['DELETE_IVY_FILES']:
+        ivy_service.delete_file(ivy_file.file_name)
+    else:
+        app.logger.info("Not Deleting Files, per DELETE_IVY_FILES flag")
 
 
 def notify_by_email(file_name=None, retry=False):
@@ -211,51 +290,132 @@ def notify_by_email(file_name=None, retry=False):
 
 
 def _notify_by_email(file_name=None, retry=False):
-    """Sends out notifications via email"""
-    sample_query = db.session.query(Sample) \
-        .filter(Sample.result_code != None) \
-        .filter(Sample.email_notified == False)
-    if file_name:
-        sample_query = sample_query.filter(Sample.ivy_file == file_name)
-    samples = sample_query.all()
+    """Sends out notifications via email, over a pool of SMTP connections, as fast as the
+    relay allows.  When the relay throttles us (a 451, or a dropped connection) we slow down,
+    back off and carry on, giving up for this run after MAIL_MAX_THROTTLES."""
+    outbox = OutboxService(EMAIL_TYPE) if app.config['NOTIFICATION_OUTBOX'] else None
+    notifier = NotificationService(app)
+
+    def messages():
+        """Emails are rendered here, on this thread, as the dispatcher is ready for them."""
+        for samples in _samples_to_notify(EMAIL_TYPE, file_name, retry, outbox):
+            for sample in samples:
+                try:
+                    with metrics.timer('email_build_seconds'):
+                        message = notifier.build_result_email(sample)
+                except Exception as e:
+                    _email_failed(recorder, sample, e)
+                    continue
+                yield sample, message, [sample.email]
+
     count = 0
-    with NotificationService(app) as notifier:
-        for sample in samples:
-            last_failure = sample.last_failure_by_type(EMAIL_TYPE)
-            if last_failure and not retry:
-                continue
-            try:
-                assert (sample.email != None)
-                notifier.send_result_email(sample)
-                count += 1
-                sample.email_notified = True
-                db.session.add(Notification(type=EMAIL_TYPE, sample=sample, successful=True))
-            except AssertionError as e:
-                app.logger.error(f'Email not provided for Sample: {sample.barcode} ', exc_info=True)
-                continue
-            except smtplib.SMTPServerDisconnected as de:
-                app.logger.error("Database connection terminated, stopping for now.", exc_info=True)
-                break
-            except smtplib.SMTPResponseException as re:
-                if re.smtp_code == 451:
-                    app.logger.error("Too many messages error from SMTP Service, stopping for now.", exc_info=True)
-                    break
+    throttles = 0
+    controller = _email_rate_controller()
+    completed = False
+    try:
+        with NotificationRecorder(EMAIL_TYPE) as recorder, \
+                EmailDispatcher(notifier, rate_limiter=controller) as dispatcher:
+            for sample, error in dispatcher.send(messages()):
+                if error is None:
+                    count += 1
+                    metrics.increment('email_sent')
+                    recorder.record(sample)
+                    controller.on_success()
+                elif _is_throttled(error):
+                    metrics.increment(f'email_throttled{{code={_failure_code(error)}}}')
+                    backoff = controller.on_throttle()
+                    if backoff is not None:
+                        throttles += 1
+                        app.logger.warning(f"Throttled by the SMTP Service ({error}), slowing to {controller.rate} "
+                                           f"messages a second, and backing off for {backoff} seconds.")
+                    if throttles > app.config['MAIL_MAX_THROTTLES']:
+                        app.logger.error("Throttled too many times by the SMTP Service, stopping for now.")
+                        dispatcher.stop()
+                    else:
+                        dispatcher.retry(sample)
                 else:
-                    app.logger.error(f'An exception happened in EmailService sending to {sample.email} ', exc_info=True)
-                    app.logger.error(str(e))
-                    db.session.add(Notification(type=EMAIL_TYPE, sample=sample, successful=False,
-                                                error_message=str(e)))
-            except Exception as e:
-                app.logger.error(f'An exception happened in EmailService sending to {sample.email} ', exc_info=True)
-                app.logger.error(str(e))
-                db.session.add(Notification(type=EMAIL_TYPE, sample=sample, successful=False,
-                                            error_message=str(e)))
-            db.session.commit()
-            sleep(0.5)
-            if count > 190:  # At 2 a second, it should take 80 seconds or around a minute and 1/2 to send out a set.
-                app.logger.info("Reached the max 190 messages, stopping for now.")
-                break
+                    _email_failed(recorder, sample, error)
+        completed = True
+    finally:
+        if outbox:
+            # Only once the outcomes are recorded, or they could be sent again.
+            outbox.release(failed=not completed)
+    app.logger.info(f"Sent {count} result emails.")
+
+
+def _samples_to_notify(notification_type, file_name, retry, outbox):
+    """Generates lists of the samples waiting to be notified.  With NOTIFICATION_OUTBOX they are
+    leased from the outbox a batch at a time, so any number of workers can share them, otherwise
+    they are read a page at a time.  Either way, each list is dropped from the session once the
+    next is asked for.  Counts those skipped, as the last attempt failed, unless retrying."""
+    if not retry:
+        skipped = db.session.query(Sample)\
+            .filter(Sample.waiting_for(notification_type, retry=True))\
+            .filter(getattr(Sample, f'{notification_type}_failed') == True)
+        if file_name:
+            skipped = skipped.filter(Sample.ivy_file == file_name)
+        metrics.increment(f'{notification_type}_skipped_prior_failure', skipped.count())
+    pages = _pages_to_notify(notification_type, file_name, retry, outbox)
+    try:
+        while True:
+            with metrics.timer(f'{notification_type}_query_seconds'):
+                samples = next(pages, None)
+            if samples is None:
+                return
+            yield samples
+    finally:
+        pages.close()
+
+
+def _pages_to_notify(notification_type, file_name, retry, outbox):
+    if outbox is None:
+        yield from SampleService().waiting_for_notification(notification_type, file_name, retry)
+        return
+
+    # Pick up anything that was missed, or has failed before if we are retrying.
+    OutboxService.enqueue(notification_type, file_name, retry)
+    db.session.commit()
+    samples = outbox.lease(file_name)
+    while samples:
+        try:
+            yield samples
+        finally:
+            for sample in samples:
+                if sample in db.session:
+                    db.session.expunge(sample)
+        samples = outbox.lease(file_name)
+
+
+def _email_rate_controller():
+    return AdaptiveRateController('smtp',
+                                  max_rate=app.config['MAIL_RATE_PER_SECOND'],
+                                  min_rate=app.config['MAIL_RATE_MIN_PER_SECOND'],
+                                  per_hour=app.config['MAIL_RATE_PER_HOUR'],
+                                  backoff_seconds=app.config['MAIL_BACKOFF_SECONDS'],
+                                  increase_after=app.config['MAIL_RATE_INCREASE_AFTER'])
+
+
+def _is_throttled(error):
+    """The relay is asking us to slow down (a 451), or dropped / refused the connection."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in (421, 451) or isinstance(error, smtplib.SMTPConnectError)
+    return isinstance(error, smtplib.SMTPServerDisconnected) or \
+        not isinstance(error, smtplib.SMTPException) and isinstance(error, OSError)
+
 
+def _email_failed(recorder, sample, error):
+    app.logger.error(f'An exception happened in EmailService sending to {sample.email} ', exc_info=error)
+    metrics.increment(f'email_failed{{code={_failure_code(error)}}}')
+    recorder.record(sample, error_message=str(error))
+
+
+def _failure_code(error):
+    """The SMTP reply code, if the server gave one, otherwise the kind of error."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return type(error).__name__
 
 
 def notify_by_text(file_name=None, retry=False):
@@ -266,35 +426,75 @@ def notify_by_text(file_name=None, retry=False):
 def _notify_by_text(file_name=None, retry=False):
     """Sends out notifications via SMS Message, but only at reasonable times of day,
        Can be resticted to a specific file name, and will attempt to retry on previous
-       failures if requested to do so. """
-
-    with NotificationService(app) as notifier:
-        if not notifier.is_reasonable_hour_for_text_messages:
-            print("Skipping text messages, it's not a good time to get one.")
-            return
-        sample_query = db.session.query(Sample) \
-            .filter(Sample.result_code != None) \
-            .filter(Sample.text_notified == False)
-        if file_name:
-            sample_query = sample_query.filter(Sample.ivy_file == file_name)
-
-        # Do not limit texts, as errors pile up we end up sending less and less, till none go out.
-        # sample_query = sample_query.limit(150)  # Only send out 150 texts at a time.
-        samples = sample_query.all()
-        count = 0
-        for sample in samples:
-            last_failure = sample.last_failure_by_type(TEXT_TYPE)
-            if last_failure and not retry:
-                continue
-            try:
-                notifier.send_result_sms(sample)
-                count += 1
-                sample.text_notified = True
-                db.session.add(Notification(type=TEXT_TYPE, sample=sample, successful=True))
-            except Exception as e:
-                db.session.add(Notification(type=TEXT_TYPE, sample=sample, successful=False,
-                                            error_message=str(e)))
-            db.session.commit()
-            sleep(0.5)
-            if count > 190:
-                break
+       failures if requested to do so.  Messages are sent several at a time by the
+       SmsDispatcher.  At other times, the texts are queued in the outbox until 8am Eastern,
+       when the scheduler drains the queue (see scheduler.drain_texts)."""
+
+    notifier = NotificationService(app)
+    opens = notifier.text_window_opens()
+    if opens is not None:
+        queued = OutboxService.enqueue(TEXT_TYPE, file_name, retry, not_before=opens)
+        db.session.commit()
+        depth, _ = OutboxService.depth(TEXT_TYPE)
+        metrics.set('text_queue_depth', depth)
+        app.logger.info(f"Not a good time for a text, queued {queued} more until {opens}, {depth} are waiting.")
+        return
+
+    # Do not limit texts, as errors pile up we end up sending less and less, till none go out.
+    outbox = OutboxService(TEXT_TYPE) if app.config['NOTIFICATION_OUTBOX'] else None
+    count = 0
+    start = time.monotonic()
+    completed = False
+    try:
+        with NotificationRecorder(TEXT_TYPE) as recorder:
+            for samples in _samples_to_notify(TEXT_TYPE, file_name, retry, outbox):
+                messages = []
+                for sample in samples:
+                    try:
+                        with metrics.timer('text_build_seconds'):
+                            messages.append((sample, *notifier.build_result_sms(sample)))
+                    except Exception as e:
+                        _text_failed(recorder, sample, e)
+
+                for sample, error in SmsDispatcher(app).send(messages):
+                    if error is None:
+                        count += 1
+                        metrics.increment('text_sent')
+                        recorder.record(sample)
+                    else:
+                        _text_failed(recorder, sample, error)
+        completed = True
+    finally:
+        if outbox:
+            outbox.release(failed=not completed)
+    seconds = time.monotonic() - start
+    depth, _ = OutboxService.depth(TEXT_TYPE)
+    metrics.set('text_drain_seconds', seconds)
+    metrics.set('text_drain_sent', count)
+    metrics.set('text_queue_depth', depth)
+    app.logger.info(f"Sent {count} result texts in {seconds:.1f} seconds, {depth} are still waiting.")
+
+
+def get_metrics():
+    """Counters, gauges and per stage timings for the notifications sent by this process."""
+    return metrics.snapshot()
+
+
+def get_notification_latency(group_by='ivy_file', type=None):
+    """Percentile waits, in seconds, from results coming in to students being notified."""
+    return LatencyService.percentiles(group_by, type)
+
+
+def get_text_queue():
+    """How many texts are waiting to go out, when they can, and how the last run went."""
+    depth, not_before = OutboxService.depth(TEXT_TYPE)
+    return {'depth': depth,
+            'not_before': not_before.isoformat() if not_before else None,
+            'last_drain_seconds': metrics.get('text_drain_seconds'),
+            'last_drain_sent': metrics.get('text_drain_sent')}
+
+
+def _text_failed(recorder, sample, error):
+    app.logger.error(f'An exception happened sending a text to {sample.phone} ', exc_info=error)
+    metrics.increment(f'text_failed{{code={_failure_code(error)}}}')
+    recorder.record(sample, error_message=str(error))
@@ -2,4 +2,8 @@ from communicator.models.sample import Sample, SampleSchema
 from communicator.models.deposit import Deposit, DepositSchema
 from communicator.models.ivy_file import IvyFile, IvyFileSchema
 
-from communicator.models.notification import Notification
\ No newline at end of file
+from communicator.models.notification import Notification
+from communicator.models.rate_limit_state import RateLimitState
+from communicator.models.notification_outbox import NotificationOutbox
+from communicator.models.invitation import Invitation
+from communicator.models.invitation_batch import InvitationBatch
@@ -1,6 +1,7 @@
 from sqlalchemy import func
 
 from communicator import db
+from communicator.models.invitation_batch import InvitationBatch
 
 class Invitation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -8,4 +9,6 @@ class Invitation(db.Model):
     location = db.Column(db.String)
     date = db.Column(db.String)
     total_recipients = db.Column(db.Integer)
-    coolness = db.Boolean()
\ No newline at end of file
+    coolness = db.Boolean()
+    batches = db.relationship(InvitationBatch, back_populates="invitation", cascade="all, delete, delete-orphan",
+                              order_by=InvitationBatch.id)
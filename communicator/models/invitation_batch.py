@@ -0,0 +1,22 @@
+from communicator import db
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class InvitationBatch(db.Model):
+    """Some of the recipients of an invitation, MAIL_MAX_RECIPIENTS at most, sent as one message,
+    so a batch the relay turns down can be sent again on its own."""
+    id = db.Column(db.Integer, primary_key=True)
+    invitation_id = db.Column(db.Integer, db.ForeignKey('invitation.id', ondelete='CASCADE'), nullable=False)
+    recipients = db.Column(db.String, nullable=False)  # One address per line
+    status = db.Column(db.String, default=PENDING, nullable=False)  # pending, sent or failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error_message = db.Column(db.String)
+    date_sent = db.Column(db.DateTime(timezone=True))
+    invitation = db.relationship("Invitation", back_populates="batches")
+
+    @property
+    def recipient_list(self):
+        return self.recipients.splitlines()
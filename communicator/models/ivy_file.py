@@ -12,6 +12,18 @@ class IvyFile(db.Model):
     file_name = db.Column(db.String, primary_key=True)
     date_added = db.Column(db.DateTime(timezone=True), default=func.now())
     sample_count = db.Column(db.Integer)
+    date_completed = db.Column(db.DateTime(timezone=True))  # Remains empty until every sample is loaded.
+    file_size = db.Column(db.BigInteger)
+    file_mtime = db.Column(db.Float)
+    file_hash = db.Column(db.String, index=True)  # sha256 of the file's content
+    duplicate_of = db.Column(db.String)  # Name of an earlier file with exactly the same content.
+
+    def is_unchanged(self, file_size, file_mtime):
+        """True if this file was completely imported, and it has the same size and modification
+        time as it had then."""
+        return self.date_completed is not None and \
+            self.file_size == file_size and \
+            self.file_mtime == file_mtime
 class IvyFileSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = IvyFile
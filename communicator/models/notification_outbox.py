@@ -0,0 +1,22 @@
+from sqlalchemy import func
+
+from communicator import db
+
+
+class NotificationOutbox(db.Model):
+    """A sample waiting to be sent an email or a text.  Workers lease rows, a batch at a time, and
+    the row is removed once the outcome is recorded. A lease that runs out (the worker died, or
+    was stopped) leaves the row to be picked up again. Rows are not leased before not_before, so texts
+    that come in overnight wait for the morning."""
+    id = db.Column(db.Integer, primary_key=True)
+    sample_barcode = db.Column(db.String, db.ForeignKey('sample.barcode', ondelete='CASCADE'), nullable=False)
+    type = db.Column(db.String, nullable=False)  # Either 'email' or 'text'
+    created = db.Column(db.DateTime(timezone=True), default=func.now())
+    lease_owner = db.Column(db.String)
+    leased_until = db.Column(db.DateTime(timezone=True))
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    not_before = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        db.UniqueConstraint('sample_barcode', 'type'),
+    )
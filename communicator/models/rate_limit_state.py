@@ -0,0 +1,13 @@
+from sqlalchemy import func
+
+from communicator import db
+
+
+class RateLimitState(db.Model):
+    """What we currently believe a relay (ex. 'smtp') will accept, shared by every run and worker."""
+    name = db.Column(db.String, primary_key=True)
+    rate = db.Column(db.Float)  # Messages per second, empty for no limit.
+    backoff_until = db.Column(db.DateTime(timezone=True))  # Don't send anything before this time.
+    throttle_count = db.Column(db.Integer, default=0)
+    last_throttled = db.Column(db.DateTime(timezone=True))
+    updated = db.Column(db.DateTime(timezone=True), default=func.now())
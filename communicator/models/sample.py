@@ -1,11 +1,14 @@
 from datetime import datetime
+from functools import lru_cache
 
 import marshmallow
+import phonenumbers
 from marshmallow import EXCLUDE
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from sqlalchemy import and_
 
 from communicator import db
-from communicator.models.notification import Notification
+from communicator.models.notification import Notification, EMAIL_TYPE
 
 
 class Sample(db.Model):
@@ -18,6 +21,8 @@ class Sample(db.Model):
     location = db.Column(db.Integer)
     station = db.Column(db.Integer)
     phone = db.Column(db.String)
+    phone_e164 = db.Column(db.String)  # The phone number normalized (see normalize_phone) as it is loaded.
+    phone_valid = db.Column(db.Boolean)
     email = db.Column(db.String)
     result_code = db.Column(db.String)
     ivy_file = db.Column(db.String)
@@ -25,34 +30,91 @@ class Sample(db.Model):
     in_ivy = db.Column(db.Boolean, default=False)  # Has this record come in from the IVY?
     email_notified = db.Column(db.Boolean, default=False)
     text_notified = db.Column(db.Boolean, default=False)
+    # Did the last attempt to notify by email / text fail?  Kept up to date by NotificationRecorder, so
+    # the samples to notify can be found without loading all their notifications.
+    email_failed = db.Column(db.Boolean, default=False, nullable=False)
+    text_failed = db.Column(db.Boolean, default=False, nullable=False)
+    # When the result came in, and when it first reached the student by email / text, for tracking
+    # how long they wait (see LatencyService).
+    result_received_on = db.Column(db.DateTime(timezone=True))
+    email_notified_on = db.Column(db.DateTime(timezone=True))
+    text_notified_on = db.Column(db.DateTime(timezone=True))
     notifications = db.relationship(Notification, back_populates="sample",
                                     cascade="all, delete, delete-orphan",
                                     order_by=Notification.date.desc)
 
-    def last_failure_by_type(self, notification_type):
-        notifications = list(filter(lambda x: x.type == notification_type, self.notifications))
-        if len(notifications) == 0:
-            return  # No notifications yet.
-        elif notifications[0].successful:
-            return  # Last notification was successful.
+    __table_args__ = (
+        # Only a small part of the table is ever waiting to be notified.
+        db.Index('ix_sample_email_pending', 'ivy_file',
+                 postgresql_where=db.text('result_code IS NOT NULL AND NOT email_notified')),
+        db.Index('ix_sample_text_pending', 'ivy_file',
+                 postgresql_where=db.text('result_code IS NOT NULL AND NOT text_notified')),
+        # The order they are read in, a page at a time, see SampleService.waiting_for_notification
+        db.Index('ix_sample_email_pending_order', 'created_on', 'barcode',
+                 postgresql_where=db.text('result_code IS NOT NULL AND NOT email_notified')),
+        db.Index('ix_sample_text_pending_order', 'created_on', 'barcode',
+                 postgresql_where=db.text('result_code IS NOT NULL AND NOT text_notified')),
+    )
+
+    # Columns that follow the "non-null wins" rule when merging, new values replace the old ones only
+    # when they are present.
+    MERGED_COLUMNS = ['computing_id', 'phone', 'email', 'result_code', 'ivy_file']
+    # Flags that can be turned on by a new record, but never turned off.
+    MERGED_FLAGS = ['in_firebase', 'in_ivy']
+    # Columns derived from the phone number, replaced along with it.
+    PHONE_COLUMNS = ['phone_e164', 'phone_valid']
+    # Columns that keep the first value they are given.
+    FIRST_COLUMNS = ['result_received_on']
+
+    @staticmethod
+    def waiting_for(notification_type, retry=False):
+        """The criteria for samples waiting to be notified by email or text.  Samples whose last
+        attempt failed are only included when retrying."""
+        criteria = [Sample.result_code != None, getattr(Sample, f'{notification_type}_notified') == False]
+        if notification_type == EMAIL_TYPE:
+            criteria.append(Sample.email != None)
         else:
-            return notifications[0]
+            criteria.append(Sample.phone_valid == True)
+        if not retry:
+            criteria.append(getattr(Sample, f'{notification_type}_failed') == False)
+        return and_(*criteria)
 
     def merge(self, sample):
-        if sample.computing_id:
-            self.computing_id = sample.computing_id
-        if sample.phone:
-            self.phone = sample.phone
-        if sample.email:
-            self.email = sample.email
-        if sample.result_code:
-            self.result_code = sample.result_code
-        if sample.in_firebase:
-            self.in_firebase = True
-        if sample.in_ivy:
-            self.in_ivy = True
-        if sample.ivy_file:
-            self.ivy_file = sample.ivy_file
+        """Merges the values from another record for the same sample into this one, returning
+        True if anything actually changed."""
+        changed = False
+        for column in Sample.MERGED_COLUMNS:
+            value = getattr(sample, column)
+            if value and getattr(self, column) != value:
+                setattr(self, column, value)
+                changed = True
+                if column == 'phone':
+                    for phone_column in Sample.PHONE_COLUMNS:
+                        setattr(self, phone_column, getattr(sample, phone_column))
+        for flag in Sample.MERGED_FLAGS:
+            if getattr(sample, flag) and not getattr(self, flag):
+                setattr(self, flag, True)
+                changed = True
+        for column in Sample.FIRST_COLUMNS:
+            if getattr(self, column) is None and getattr(sample, column) is not None:
+                setattr(self, column, getattr(sample, column))
+                changed = True
+        return changed
+
+
+@lru_cache(maxsize=16384)
+def normalize_phone(phone):
+    """Returns the phone number in E.164 format (ex '+15555555555'), and whether it is a valid
+    number, as IVY sends them in all sorts of formats (ex '555/555-5555').  Numbers without a
+    country code are assumed to be in the US."""
+    if not phone:
+        return None, False
+    try:
+        number = phonenumbers.parse(phone, "US")
+    except phonenumbers.NumberParseException:
+        return None, False
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164), \
+        phonenumbers.is_valid_number(number)
 
 
 class NotificationSchema(SQLAlchemyAutoSchema):
@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime
 
 import pytz
@@ -9,6 +10,15 @@ import atexit
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from communicator.api import admin
+from communicator.services.ivy_watcher import IvyWatcher
+from communicator.services.metrics import metrics
+
+# The watcher and the scheduled task must not load files at the same time.
+update_lock = threading.Lock()
+# Notifications are sent by a job of their own, so a long run of emails never holds up loading new
+# files, and a run that is still going when the next one is due is left to finish.
+notify_lock = threading.Lock()
+scheduler = None
 
 
 def within_notification_window():
@@ -19,25 +29,71 @@ def within_notification_window():
     return one_pm <= now <= two_pm
 
 
+def load_files():
+    with update_lock, app.app_context():
+        # Do not request IVY transfers, they happen automatically, just load the local files if they exist.
+        admin.load_local_files()
+
+
+def notify():
+    """Sends any emails that need sending, unless the last run is still at it."""
+    if not notify_lock.acquire(blocking=False):
+        app.logger.info("Still sending the last round of emails, skipping this one.")
+        return
+    try:
+        with app.app_context():
+            admin._notify_by_email()
+            app.logger.info("Notification metrics:\n" + metrics.report())
+    finally:
+        notify_lock.release()
+
+
 def update():
+    load_files()
+    notify()
+
+
+def files_arrived():
+    """Loads new files as soon as the watcher sees them, and sends their emails in the background."""
+    load_files()
+    if scheduler:
+        scheduler.modify_job('notify', next_run_time=datetime.now(pytz.utc))
+
+
+def drain_texts():
+    """Sends the texts that have been waiting overnight, as soon as it is a reasonable hour."""
     with app.app_context():
-        # Do not request IVY transfers, they happen automatically, just load the local files if they exist,
-        # and send any emails that need sending.
-        admin.load_local_files()
-        admin._notify_by_email()
+        admin._notify_by_text()
 
 
 if app.config['RUN_SCHEDULED_TASKS']:
     scheduler = BackgroundScheduler()
     scheduler.add_jobstore('sqlalchemy', url=db.engine.url)
     scheduler.add_job(
-        update, 'interval', minutes=app.config['SCHEDULED_TASK_MINUTES'],
+        load_files, 'interval', minutes=app.config['SCHEDULED_TASK_MINUTES'],
         id='update', replace_existing=True
     )
+    scheduler.add_job(
+        notify, 'interval', minutes=app.config['SCHEDULED_TASK_MINUTES'],
+        id='notify', replace_existing=True
+    )
+    scheduler.add_job(
+        drain_texts, 'cron', hour=8, timezone=pytz.timezone('US/Eastern'),
+        id='drain_texts', replace_existing=True
+    )
     scheduler.start()
 
     # Shut down the scheduler when exiting the app
     atexit.register(lambda: scheduler.shutdown())
+
+    # Load files as soon as they arrive, the scheduled task remains as a safety net, and to retry emails.
+    if app.config['IVY_WATCH_DIRECTORY']:
+        watcher = IvyWatcher(app.config['IVY_IMPORT_DIR'], files_arrived,
+                             debounce_seconds=app.config['IVY_WATCH_DEBOUNCE_SECONDS'],
+                             poll=app.config['IVY_WATCH_POLL'],
+                             poll_seconds=app.config['IVY_WATCH_POLL_SECONDS'])
+        watcher.start()
+        atexit.register(watcher.stop)
 else:
     app.logger.info("Currently not running scheduled tasks RUN_SCHEDULED_TASKS"
                     " is set to false in configuration.")
@@ -0,0 +1,143 @@
+import csv
+import io
+from os.path import join
+
+from sqlalchemy import Table, MetaData, Column, Integer, String, DateTime, Boolean, select, literal, true, false, \
+    func, cast, case
+from sqlalchemy.dialects.postgresql import insert, array_agg, aggregate_order_by
+
+from communicator import db
+from communicator.models.sample import Sample
+from communicator.services.ivy_service import IvyService, IVY_ROW_FIELDS
+from communicator.services.sample_service import SampleService
+
+# Rows are copied here before being merged into the sample table.  It is unlogged, as it is
+# truncated before every import, and kept out of the application's metadata, so it isn't managed
+# by migrations.
+staging_table = Table('sample_staging', MetaData(),
+                      Column('line_number', Integer),
+                      Column('barcode', String),
+                      Column('student_id', String),
+                      Column('phone', String),
+                      Column('email', String),
+                      Column('location', String),
+                      Column('result_code', String),
+                      Column('date', DateTime(timezone=True)),
+                      Column('phone_e164', String),
+                      Column('phone_valid', String),
+                      prefixes=['UNLOGGED'])
+
+STAGING_COLUMNS = ('line_number',) + IVY_ROW_FIELDS
+
+
+class CopyImportService(object):
+    """Loads large IVY files into Postgres far faster than inserting them through the ORM. The
+    file is streamed, after mapping the columns and normalizing the dates, into an unlogged staging
+    table with COPY FROM STDIN, and then merged into the sample table with a single statement that
+    applies the same rules as Sample.merge."""
+
+    def import_file(self, path, file_name):
+        """Imports the file, returning UpsertCounts for the rows that were loaded. Does not commit."""
+        connection = db.session.connection()
+        staging_table.create(connection, checkfirst=True)
+        connection.execute(f'TRUNCATE {staging_table.name}')  # Also locks out concurrent imports.
+
+        date_failures = []
+        with open(join(path, file_name), 'r') as csv_file:
+            rows = (IvyService.record_to_row(record, date_failures)
+                    for record in csv.DictReader(csv_file, delimiter='|'))
+            stream = _CopyStream((line_number,) + row for line_number, row in enumerate(rows))
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY {staging_table.name} ({', '.join(STAGING_COLUMNS)}) "
+                                   f"FROM STDIN WITH (FORMAT csv)", stream)
+            row_count = stream.row_count
+        IvyService.report_date_failures(file_name, date_failures)
+
+        barcodes = connection.execute(select([func.count(staging_table.c.barcode.distinct())])).scalar()
+        counts = SampleService.count_upserts(connection.execute(self.merge_statement(file_name)))
+        counts.duplicates = row_count - barcodes
+        counts.unchanged = barcodes - counts.new - counts.changed
+        return counts
+
+    @staticmethod
+    def merge_statement(file_name):
+        """Inserts the staged rows into the sample table, merging them into existing records just as
+        SampleService.upsert_records would.  If a barcode appears more than once in the file, the rows
+        are merged just as SampleService._merge_duplicates would, values from the first row, updated with any
+        non-empty values that follow it."""
+        staged = staging_table.c
+        rows = select([staged.barcode,
+                       cast(func.nullif(_first(staged.student_id), ''), Integer),
+                       _last_present(staged.phone),
+                       _last_present(staged.email),
+                       cast(func.nullif(_first(staged.location), ''), Integer),
+                       _last_present(staged.result_code),
+                       _first(staged.date),
+                       func.nullif(_last_present(staged.phone_e164, staged.phone), ''),
+                       cast(_last_present(staged.phone_valid, staged.phone), Boolean),
+                       literal(file_name),
+                       true(),
+                       false(),
+                       false(),
+                       false(),
+                       false(),
+                       false(),
+                       func.timezone('utc', func.now()),
+                       func.timezone('utc', func.now()),
+                       case([(func.count().filter(staged.result_code != '') > 0, func.now())])])\
+            .group_by(staged.barcode)
+        return SampleService.on_conflict_merge(insert(Sample.__table__).from_select(
+            ['barcode', 'student_id', 'phone', 'email', 'location', 'result_code', 'date', 'phone_e164',
+             'phone_valid', 'ivy_file', 'in_ivy', 'in_firebase', 'email_notified', 'text_notified', 'email_failed',
+             'text_failed', 'created_on', 'last_modified', 'result_received_on'], rows))
+
+
+def _first(column):
+    """The value from the first row for the barcode."""
+    return array_agg(aggregate_order_by(column, staging_table.c.line_number))[1]
+
+
+def _last_present(column, key=None):
+    """The last non-empty value for the barcode, as with Sample.MERGED_COLUMNS in Sample.merge. If a
+    key column is given, the value from the last row where the key is not empty, as with
+    Sample.PHONE_COLUMNS, which follow the phone number."""
+    if key is None:
+        present = array_agg(aggregate_order_by(column, staging_table.c.line_number.desc())).filter(column != '')
+        return func.coalesce(present[1], _first(column))
+    present = array_agg(aggregate_order_by(column, staging_table.c.line_number.desc())).filter(key != '')
+    return case([(func.count().filter(key != '') > 0, present[1])], else_=_first(column))
+
+
+class _CopyStream(io.TextIOBase):
+    """A read only file like object, that renders rows as CSV as COPY asks for them, so the whole
+    file never needs to be held in memory."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        self.pending = ''
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.row_count += 1
+            if self.buffer.tell() > 65536:
+                self._drain()
+        self._drain()
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def _drain(self):
+        self.pending += self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
@@ -0,0 +1,67 @@
+import re
+from email.header import Header
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from functools import lru_cache
+from os.path import join
+
+from markupsafe import escape
+
+from communicator import app
+
+
+@lru_cache(maxsize=1)
+def logo_image():
+    """The logo, as a MIME part ready to attach. Read and encoded once, and shared by every
+    message (it is never modified once built)."""
+    with open(join(app.root_path, 'static', 'assets', 'img', 'brand', 'uva_logo.png'), 'rb') as fp:
+        image = MIMEImage(fp.read())
+    # Define the image's ID as referenced in the html templates
+    image.add_header('Content-ID', '<logo>')
+    return image
+
+
+class ResultEmailBuilder(object):
+    """Builds result emails.  The templates are rendered once, with placeholders for the link
+    and tracking code, the subject is encoded once, and the logo is read once per process, so
+    building each message only fills in the per-recipient fields and assembles the MIME parts."""
+
+    SUBJECT = "UVA: BE SAFE Notification"
+    PLACEHOLDER = re.compile('@@(link|tracking_code)@@')
+
+    def __init__(self, sender, base_url):
+        self.sender = sender
+        self.subject = Header(self.SUBJECT.encode('utf-8'), 'utf-8').encode()
+        self.text = self._render("emails/result_email.txt", base_url)
+        self.html = self._render("emails/result_email.html", base_url)
+
+    def build(self, recipient, link, tracking_code):
+        msgRoot = MIMEMultipart('related')
+        msgRoot.set_charset('utf8')
+        msgRoot['Subject'] = self.subject
+        msgRoot['From'] = self.sender
+        msgRoot['To'] = recipient
+        msgRoot.preamble = 'This is a multi-part message in MIME format.'
+
+        msgAlternative = MIMEMultipart('alternative')
+        msgRoot.attach(msgAlternative)
+        text_body = self._fill(self.text, link=link, tracking_code=tracking_code)
+        html_body = self._fill(self.html, link=escape(link), tracking_code=escape(tracking_code))
+        msgAlternative.attach(MIMEText(text_body, 'plain', _charset='UTF-8'))
+        msgAlternative.attach(MIMEText(html_body, 'html', _charset='UTF-8'))
+        msgRoot.attach(logo_image())
+        return msgRoot
+
+    def _render(self, template_name, base_url):
+        """Renders the template with placeholders, returning the skeleton: the rendered text split
+        around them, [text, name, text, name, text ...]"""
+        rendered = app.jinja_env.get_template(template_name).render(base_url=base_url, link='@@link@@',
+                                                                     tracking_code='@@tracking_code@@')
+        return self.PLACEHOLDER.split(rendered)
+
+    @staticmethod
+    def _fill(skeleton, **values):
+        parts = list(skeleton)
+        parts[1::2] = [values[name] for name in skeleton[1::2]]
+        return ''.join(parts)
@@ -0,0 +1,82 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from communicator.services.metrics import metrics
+from communicator.services.rate_limiter import RateLimiter
+
+
+class EmailDispatcher(object):
+    """Sends emails on MAIL_POOL_SIZE threads at once, over connections from the process's
+    SmtpConnectionPool (see NotificationService.email_pool), which stay open after the run.  The
+    rate limiter (by default MAIL_RATE_PER_SECOND / MAIL_RATE_PER_HOUR) decides how fast they go.
+    ex:
+
+    with EmailDispatcher(notifier) as dispatcher:
+        for sample, error in dispatcher.send(messages):
+            ...
+    """
+
+    def __init__(self, notifier, pool_size=None, rate_limiter=None, connection_pool=None):
+        config = notifier.app.config
+        self.notifier = notifier
+        self.pool_size = pool_size or config['MAIL_POOL_SIZE']
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(config['MAIL_RATE_PER_SECOND'], config['MAIL_RATE_PER_HOUR'])
+        self.rate_limiter = rate_limiter
+        self.testing = 'TESTING' in config and config['TESTING']
+        self.connection_pool = connection_pool
+        self.executor = None
+        self.stopped = False
+        self.retries = deque()
+        self.failed = {}
+
+    def __enter__(self):
+        if self.connection_pool is None and not self.testing:
+            self.connection_pool = self.notifier.email_pool()
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix='email')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.executor.shutdown()
+
+    def stop(self):
+        """Stops sending new messages, those already on their way are still reported by send()."""
+        self.stopped = True
+
+    def retry(self, key):
+        """Sends a message that just failed again, once the rate limiter allows."""
+        self.retries.append(self.failed.pop(key))
+
+    def send(self, messages):
+        """Sends the messages, an iterable of (key, message, recipients) tuples, yielding (key, error)
+        for each one as it completes, where error is None if it was sent.  Messages are only pulled
+        from the iterable as there is room for them, so they can be built as we go.  A failed
+        message can be sent again by calling retry(key) before moving on to the next result."""
+        messages = iter(messages)
+        in_flight = {}
+        while True:
+            self.failed.clear()
+            while not self.stopped and len(in_flight) < self.pool_size * 2:
+                item = self.retries.popleft() if self.retries else next(messages, None)
+                if item is None:
+                    break
+                in_flight[self.executor.submit(self._send, item[1], item[2])] = item
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                if error is not None:
+                    self.failed[item[0]] = item
+                yield item[0], error
+
+    def _send(self, message, recipients):
+        with metrics.timer('email_rate_wait_seconds'):
+            self.rate_limiter.acquire()
+        with metrics.timer('email_send_seconds'):
+            if self.connection_pool is None:
+                self.notifier.deliver(message, recipients)
+            else:
+                self.connection_pool.send(lambda server: self.notifier.deliver(message, recipients, server))
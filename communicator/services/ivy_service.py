@@ -1,7 +1,10 @@
 import csv
+import hashlib
 import json
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from parser import ParserError
+from functools import lru_cache
+from itertools import islice
 
 import globus_sdk
 import pytz
@@ -11,10 +14,25 @@ from dateutil import parser
 from communicator import app, db
 from communicator.errors import CommError
 from communicator.models.ivy_file import IvyFile
-from communicator.models.sample import Sample
-from os import listdir, remove
+from communicator.models.sample import Sample, normalize_phone
+from os import listdir, remove, stat
 from os.path import isfile, join
 
+# The values parsed out of each IVY record, in the order they appear in the plain tuples
+# returned by IvyService.rows_from_ivy_file
+IVY_ROW_FIELDS = ('barcode', 'student_id', 'phone', 'email', 'location', 'result_code', 'date',
+                  'phone_e164', 'phone_valid')
+
+# Dates and times from the lab are in Eastern time.
+EASTERN = pytz.timezone("America/New_York")
+
+
+@lru_cache(maxsize=16384)
+def _eastern_offset(year, month, day, hour):
+    """Localizing is the slow part of parsing a date, and the offset is the same for every minute
+    of an hour, so cache it by the hour."""
+    return EASTERN.localize(datetime(year, month, day, hour)).tzinfo
+
 
 class IvyService(object):
     """Opens files uploaded to the server from IVY and imports them into the database. """
@@ -31,65 +49,222 @@ class IvyService(object):
         self.GLOBUS_DTN_PATH = app.config['GLOBUS_DTN_PATH']
         self.transfer_client = None
         self.transfer_client_date = datetime.now()
-
-    def load_directory(self):
-        """Loads files from a local directory, returning a tuple containing the list
-        of files, and the list of samples respectively"""
-
-        onlyfiles = [f for f in listdir(self.path) if isfile(join(self.path, f))]
-        app.logger.info(f'Loading directory {self.path}')
-
-        samples = []
-        files = []
-        for file_name in onlyfiles:
-            file_samples = IvyService.samples_from_ivy_file(self.path, file_name)
-            ivy_file = db.session.query(IvyFile).filter(IvyFile.file_name == file_name).first()
+        self.row_counts = {}  # Counted while hashing each file, see update_manifest.
+
+    def list_files(self):
+        """Returns the names of all the files in the local IVY import directory."""
+        return [f for f in listdir(self.path) if isfile(join(self.path, f))]
+
+    def files_to_import(self):
+        """Checks every file in the directory against the import manifest (the ivy_file table),
+        returning IvyFile records, ready to track progress, for the files that need to be imported.
+        Unchanged files are skipped based on their size and modification time alone, a file is only
+        read (to hash it) if it is new or has been modified. Files with exactly the same content
+        as a file we already imported are recorded as duplicates and skipped.  The existing records
+        are looked up all at once, and nothing is committed, so the file records are saved in the same
+        transaction as their samples."""
+        file_names = self.list_files()
+        if not file_names:
+            return []
+        known_files = {f.file_name: f for f in
+                       db.session.query(IvyFile).filter(IvyFile.file_name.in_(file_names)).all()}
+
+        changed_files = []
+        for file_name in file_names:
+            file_stat = stat(join(self.path, file_name))
+            ivy_file = known_files.get(file_name)
+            if ivy_file and ivy_file.is_unchanged(file_stat.st_size, file_stat.st_mtime):
+                self._skip_file(file_name)
+                continue
             if not ivy_file:
-                ivy_file = IvyFile(file_name=file_name, sample_count=len(file_samples))
-            else:
-                ivy_file.date_added = datetime.now()
-                ivy_file.sample_count = len(file_samples)
-            files.append(ivy_file)
-            samples.extend(file_samples)
-            app.logger.info(f'Loaded {len(file_samples)} samples from file {file_name}')
-        app.logger.info(f'Loading a total of {len(samples)} samples from {len(files)} files')
-        return files, samples
+                ivy_file = IvyFile(file_name=file_name)
+            self.update_manifest(ivy_file)
+            changed_files.append(ivy_file)
+        if not changed_files:
+            return []
+
+        # Files already imported with the same content, under this name or another.
+        imported = {}
+        with db.session.no_autoflush:
+            for f in db.session.query(IvyFile).filter(IvyFile.file_hash.in_([f.file_hash for f in changed_files]))\
+                    .filter(IvyFile.date_completed != None).all():
+                imported.setdefault(f.file_hash, f.file_name)
+
+        ivy_files = []
+        for ivy_file in changed_files:
+            db.session.add(ivy_file)
+            original = imported.get(ivy_file.file_hash)
+            if original:
+                if original != ivy_file.file_name:
+                    app.logger.info(f'File {ivy_file.file_name} is a duplicate of {original}, skipping it.')
+                    ivy_file.duplicate_of = original
+                    ivy_file.date_added = datetime.now()
+                    ivy_file.date_completed = datetime.now()
+                    ivy_file.sample_count = 0
+                self._skip_file(ivy_file.file_name)
+                continue
+            imported[ivy_file.file_hash] = ivy_file.file_name
+            ivy_file.duplicate_of = None
+            ivy_file.date_added = datetime.now()
+            ivy_file.date_completed = None
+            ivy_file.sample_count = 0
+            ivy_files.append(ivy_file)
+        app.logger.info(f'Found {len(ivy_files)} new or modified file(s) to import')
+        return ivy_files
+
+    def update_manifest(self, ivy_file):
+        """Records the current size, modification time and hash of the file, and counts its rows
+        on the same pass through the file."""
+        full_path = join(self.path, ivy_file.file_name)
+        file_stat = stat(full_path)
+        ivy_file.file_size = file_stat.st_size
+        ivy_file.file_mtime = file_stat.st_mtime
+        ivy_file.file_hash, lines = IvyService.hash_file(full_path)
+        self.row_counts[ivy_file.file_name] = max(0, lines - 1)  # Less the header.
+
+    def count_rows(self, file_name):
+        """A quick count of the records in a file, without parsing them.  Free for any file that
+        went through update_manifest, otherwise the file is read to count them."""
+        if file_name not in self.row_counts:
+            _, lines = IvyService.hash_file(join(self.path, file_name))
+            self.row_counts[file_name] = max(0, lines - 1)
+        return self.row_counts[file_name]
+
+    def _skip_file(self, file_name):
+        if app.config['DELETE_IVY_FILES']:
+            self.delete_file(file_name)
+
+    @staticmethod
+    def hash_file(full_path):
+        """Returns the sha256 of the file's content, and the number of lines in it that aren't blank."""
+        sha = hashlib.sha256()
+        lines = 0
+        partial = b''  # The start of a line that runs on into the next block.
+        with open(full_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                sha.update(block)
+                block_lines = (partial + block).split(b'\n')
+                partial = block_lines.pop()
+                lines += sum(1 for line in block_lines if line.strip())
+        return sha.hexdigest(), lines + (1 if partial.strip() else 0)
 
     @staticmethod
     def samples_from_ivy_file(path, file_name):
-        rows = []
+        return list(IvyService.iter_samples_from_ivy_file(path, file_name))
+
+    @staticmethod
+    def iter_samples_from_ivy_file(path, file_name):
+        """Generates samples from the file one record at a time, without holding the whole
+        file in memory."""
+        date_failures = []
         with open(join(path, file_name), 'r') as csv_file:
             reader = csv.DictReader(csv_file, delimiter='|')
             for row in reader:
-                sample = IvyService.record_to_sample(row, file_name)
-                rows.append(sample)
-        return rows
+                yield IvyService.row_to_sample(IvyService.record_to_row(row, date_failures), file_name)
+        IvyService.report_date_failures(file_name, date_failures)
+
+    @staticmethod
+    def chunks_from_ivy_file(path, file_name, chunk_size):
+        """Generates lists of at most chunk_size samples from the file."""
+        samples = IvyService.iter_samples_from_ivy_file(path, file_name)
+        chunk = list(islice(samples, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(islice(samples, chunk_size))
+
+    def parse_files_in_parallel(self, file_names, workers):
+        """Parses the files on a pool of worker processes, generating a (file_name, rows) tuple
+        for each file, in order, where rows are the plain tuples from rows_from_ivy_file.  Only a
+        few files are parsed ahead of the caller, so finished files don't pile up in memory."""
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for file_name in file_names:
+                pending.append((file_name, pool.submit(IvyService.rows_from_ivy_file, self.path, file_name)))
+                if len(pending) > workers:
+                    yield IvyService._parsed_file(*pending.pop(0))
+            for done_name, future in pending:
+                yield IvyService._parsed_file(done_name, future)
+
+    @staticmethod
+    def _parsed_file(file_name, future):
+        rows, date_failures = future.result()
+        IvyService.report_date_failures(file_name, date_failures)
+        return file_name, rows
+
+    @staticmethod
+    def rows_from_ivy_file(path, file_name):
+        """Parses the file into a list of plain tuples (see IVY_ROW_FIELDS). This does not touch
+        the database, so it is safe to call from a separate process.  Returns a tuple of the rows,
+        and any dates that could not be parsed, which the caller should report."""
+        date_failures = []
+        with open(join(path, file_name), 'r') as csv_file:
+            reader = csv.DictReader(csv_file, delimiter='|')
+            return [IvyService.record_to_row(row, date_failures) for row in reader], date_failures
+
+    @staticmethod
+    def chunks_from_rows(rows, file_name, chunk_size):
+        """Generates lists of at most chunk_size samples from previously parsed rows."""
+        for i in range(0, len(rows), chunk_size):
+            yield [IvyService.row_to_sample(row, file_name) for row in rows[i:i + chunk_size]]
 
     @staticmethod
-    def record_to_sample(dictionary, file_name):
-        """Creates a Test Result from a record read in from the IVY CSV File"""
-        sample = Sample()
+    def row_to_sample(row, file_name):
+        sample = Sample(**dict(zip(IVY_ROW_FIELDS, row)))
+        sample.ivy_file = file_name
+        sample.in_ivy = True
+        if sample.result_code:
+            sample.result_received_on = datetime.now(pytz.utc)
+        return sample
+
+    @staticmethod
+    def record_to_row(dictionary, date_failures=None):
+        """Pulls the values we need out of a record from the IVY CSV File, as a tuple, normalizing the
+        phone number once here, as the file is loaded. If a list of date_failures is provided,
+        unparsable dates are added to it to be reported all together, rather than reported one at
+        a time."""
         try:
             try:
-                sample.date = parser.parse(dictionary["Test Date Time"])
-                tz = pytz.timezone("America/New_York")
-                sample.date = tz.localize(sample.date)
+                date = IvyService.parse_test_date(dictionary["Test Date Time"])
             except Exception as pe:
-                sentry_sdk.capture_message(f"Failed to parse date for barcode '{dictionary['Test Bar Code']}', '{pe}'")
-                sample.date = datetime.now()
-
-            sample.barcode = dictionary['Test Bar Code']
-            sample.student_id = dictionary["Student ID"]
-            sample.phone = dictionary["Student Cellphone"]
-            sample.email = dictionary["Student Email"]
-            sample.location = dictionary["Test Kiosk Loc"]
-            sample.result_code = dictionary["Test Result Code"]
-            sample.ivy_file = file_name
-            sample.in_ivy = True
-            return sample
+                failure = f"Failed to parse date for barcode '{dictionary['Test Bar Code']}', '{pe}'"
+                if date_failures is None:
+                    sentry_sdk.capture_message(failure)
+                else:
+                    date_failures.append(failure)
+                date = datetime.now()
+
+            phone = dictionary["Student Cellphone"]
+            return (dictionary['Test Bar Code'],
+                    dictionary["Student ID"],
+                    phone,
+                    dictionary["Student Email"],
+                    dictionary["Test Kiosk Loc"],
+                    dictionary["Test Result Code"],
+                    date,
+                    *normalize_phone(phone))
         except KeyError as e:
             raise CommError("100", f"Invalid CSV Record, missing column {e}")
 
+    @staticmethod
+    def parse_test_date(value):
+        """Parses the 'Test Date Time' from IVY, which is always YYYYMMDDHHMM (ex 202009030809)
+        in Eastern time.  Anything else falls back to the (much slower) general purpose parser."""
+        if len(value) == 12 and value.isdigit():
+            try:
+                year, month, day, hour = int(value[0:4]), int(value[4:6]), int(value[6:8]), int(value[8:10])
+                return datetime(year, month, day, hour, int(value[10:12]),
+                                tzinfo=_eastern_offset(year, month, day, hour))
+            except ValueError:
+                pass  # The right shape, but not a real date, let the general parser have a go at it.
+        return EASTERN.localize(parser.parse(value))
+
+    @staticmethod
+    def report_date_failures(file_name, date_failures):
+        """Sends a single report of all the dates that could not be parsed in a file."""
+        if date_failures:
+            sentry_sdk.capture_message(f"Failed to parse {len(date_failures)} date(s) in file '{file_name}': "
+                                       + "; ".join(date_failures[:20]))
+
     def get_transfer_client(self):
 
         # Cache the client so we don't create a new one for every call, but don't hold on to it for too long.
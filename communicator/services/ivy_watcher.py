@@ -0,0 +1,155 @@
+import threading
+import time
+from os import listdir, stat
+from os.path import isfile, join
+
+from communicator import app
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
+except ImportError:  # watchdog is optional, we can fall back to polling the directory ourselves.
+    FileSystemEventHandler = object
+    Observer = PollingObserver = None
+
+
+class Debouncer(object):
+    """Collapses a burst of triggers into a single call, made once things have been quiet for
+    'delay' seconds (or 'max_wait' seconds after the first trigger, if the burst goes on and on).
+    Calls are never made concurrently, a trigger that arrives during a call causes another call
+    once it completes."""
+
+    def __init__(self, callback, delay, max_wait=60):
+        self.callback = callback
+        self.delay = delay
+        self.max_wait = max_wait
+        self.timer = None
+        self.first_trigger = None
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+
+    def trigger(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.first_trigger is None:
+                self.first_trigger = now
+            if self.timer:
+                self.timer.cancel()
+            delay = max(0, min(self.delay, self.first_trigger + self.max_wait - now))
+            self.timer = threading.Timer(delay, self._fire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def cancel(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = None
+            self.first_trigger = None
+
+    def _fire(self):
+        with self.lock:
+            self.timer = None
+            self.first_trigger = None
+        with self.running:
+            try:
+                self.callback()
+            except Exception:
+                app.logger.error("Failed to process files from the IVY import directory", exc_info=True)
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Only reacts once a file is completely written (closed after writing, or moved into place)."""
+
+    def __init__(self, debouncer):
+        self.debouncer = debouncer
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.debouncer.trigger()
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.debouncer.trigger()
+
+
+class _PollingEventHandler(_EventHandler):
+    """Polling can't tell when a file is closed, so react to any change, the debouncer waits
+    for the file to stop changing."""
+
+    def on_created(self, event):
+        self.on_closed(event)
+
+    def on_modified(self, event):
+        self.on_closed(event)
+
+
+class _DirectoryPoller(threading.Thread):
+    """Used when watchdog isn't available, looks for changes to the names, sizes or modification
+    times of the files in the directory every 'interval' seconds."""
+
+    def __init__(self, path, debouncer, interval):
+        super().__init__(daemon=True)
+        self.path = path
+        self.debouncer = debouncer
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def snapshot(self):
+        files = {}
+        for file_name in listdir(self.path):
+            full_path = join(self.path, file_name)
+            if isfile(full_path):
+                file_stat = stat(full_path)
+                files[file_name] = (file_stat.st_size, file_stat.st_mtime)
+        return files
+
+    def run(self):
+        last = self.snapshot()
+        while not self.stopped.wait(self.interval):
+            try:
+                current = self.snapshot()
+            except OSError:
+                app.logger.error(f"Unable to list the IVY import directory {self.path}", exc_info=True)
+                continue
+            if current != last:
+                self.debouncer.trigger()
+            last = current
+
+    def stop(self):
+        self.stopped.set()
+
+
+class IvyWatcher(object):
+    """Watches the IVY import directory, and calls 'callback' shortly after new files have
+    finished arriving, rather than checking on a fixed schedule.  Uses inotify (through watchdog)
+    where possible, and polls the directory when watchdog isn't installed, or when polling is
+    requested (inotify events are not delivered for network file systems)."""
+
+    def __init__(self, path, callback, debounce_seconds=5, poll=False, poll_seconds=5):
+        self.path = path
+        self.poll = poll
+        self.poll_seconds = poll_seconds
+        self.debouncer = Debouncer(callback, debounce_seconds)
+        self.observer = None
+
+    def start(self):
+        if Observer is None:
+            app.logger.info(f"Polling {self.path} for IVY files every {self.poll_seconds} seconds (no watchdog)")
+            self.observer = _DirectoryPoller(self.path, self.debouncer, self.poll_seconds)
+        elif self.poll:
+            app.logger.info(f"Polling {self.path} for IVY files every {self.poll_seconds} seconds")
+            self.observer = PollingObserver(timeout=self.poll_seconds)
+            self.observer.schedule(_PollingEventHandler(self.debouncer), self.path)
+        else:
+            app.logger.info(f"Watching {self.path} for IVY files")
+            self.observer = Observer()
+            self.observer.schedule(_EventHandler(self.debouncer), self.path)
+        self.observer.start()
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        self.debouncer.cancel()
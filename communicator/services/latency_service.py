@@ -0,0 +1,43 @@
+from sqlalchemy import func, cast, Date
+
+from communicator import db
+from communicator.models.notification import EMAIL_TYPE, TEXT_TYPE
+from communicator.models.sample import Sample
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class LatencyService(object):
+    """How long students wait, from their result coming in (Sample.result_received_on) to the
+    first email or text reaching them (Sample.email_notified_on / text_notified_on), worked out by
+    Postgres with percentile_cont, per IVY file or per day (Eastern time) the results came in."""
+
+    GROUPS = {
+        'ivy_file': Sample.ivy_file,
+        'day': cast(func.timezone('US/Eastern', Sample.result_received_on), Date),
+    }
+
+    @staticmethod
+    def percentiles(group_by='ivy_file', notification_type=None):
+        """Returns a list of dictionaries, one for each group and channel, with how many were
+        notified, and the percentile waits, in seconds."""
+        group = LatencyService.GROUPS[group_by]
+        results = []
+        for channel in [notification_type] if notification_type else [EMAIL_TYPE, TEXT_TYPE]:
+            notified_on = getattr(Sample, f'{channel}_notified_on')
+            wait = func.extract('epoch', notified_on - Sample.result_received_on)
+            query = db.session.query(group.label('group'),
+                                     func.count().label('count'),
+                                     *[func.percentile_cont(p).within_group(wait).label(f'p{int(p * 100)}')
+                                       for p in PERCENTILES])\
+                .filter(Sample.result_received_on != None)\
+                .filter(notified_on != None)\
+                .group_by(group)\
+                .order_by(group)
+            for row in query:
+                result = row._asdict()
+                group_value = result.pop('group')
+                result[group_by] = None if group_value is None else str(group_value)
+                result['type'] = channel
+                results.append(result)
+        return results
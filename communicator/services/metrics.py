@@ -0,0 +1,113 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+class Histogram(object):
+    """Counts how many observations (usually seconds) fall into each bucket, enough to tell
+    roughly where the time goes, and estimate percentiles, without keeping every value."""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # The last for anything over the largest bucket.
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """The upper bound of the bucket the q'th quantile falls in (the max for the last one)."""
+        if not self.count:
+            return None
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= q * self.count:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': {str(bound): count for bound, count in zip(self.BUCKETS + ('+Inf',), self.counts)}}
+
+
+class Metrics(object):
+    """Measurements of how notifications are going in this process: counters (such as emails sent,
+    or failed with each SMTP code), gauges that hold the latest value of something (such as how
+    many texts are waiting for the morning), and histograms of how long each stage takes. Safe to
+    share between threads, use the 'metrics' instance below.
+    ex:
+
+    with metrics.timer('email_build_seconds'):
+        message = notifier.build_result_email(sample)
+    metrics.increment('email_sent')
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        """Records the latest value of a measurement."""
+        with self.lock:
+            self.gauges[name] = value
+
+    def get(self, name, default=None):
+        with self.lock:
+            return self.gauges.get(name, default)
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Observes how many seconds the 'with' block takes, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'gauges': dict(self.gauges),
+                    'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()}}
+
+    def report(self):
+        """The snapshot, as a few lines of text, for the logs and the command line."""
+        snapshot = self.snapshot()
+        lines = [f"{name:<40} {value}" for name, value in sorted(snapshot['counters'].items())]
+        lines += [f"{name:<40} {value}" for name, value in sorted(snapshot['gauges'].items())]
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append(f"{name:<40} count {histogram['count']:<8} total {histogram['sum']:9.3f}s "
+                         f"p50 <= {histogram['p50']}s  p99 <= {histogram['p99']}s  max {histogram['max']:.3f}s")
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,107 @@
+import threading
+import time
+from datetime import datetime
+
+import pytz
+from sqlalchemy import update, case, func
+
+from communicator import app, db
+from communicator.models.notification import Notification
+from communicator.models.notification_outbox import NotificationOutbox
+from communicator.models.sample import Sample
+from communicator.services.metrics import metrics
+
+
+class NotificationRecorder(object):
+    """Records the outcome of each notification, the Notification row, and the sample's notified /
+    failed flags, and takes the sample out of the outbox (see OutboxService).  Outcomes are held,
+    and written in one transaction, with a bulk insert and a few updates, every
+    NOTIFICATION_BATCH_SIZE outcomes or NOTIFICATION_BATCH_SECONDS, whichever comes first, and
+    whatever is left when the 'with' block exits, even on an error.
+    ex:
+
+    with NotificationRecorder(EMAIL_TYPE) as recorder:
+        recorder.record(sample)
+        recorder.record(sample, error_message="It didn't go")
+
+    Outcomes are written on a connection of their own, rather than committing the session, so the
+    samples the caller is working through are not expired (and reloaded one at a time) after each
+    batch. They are expired once, when the block exits."""
+
+    def __init__(self, notification_type, batch_size=None, max_seconds=None, clock=time.monotonic):
+        self.notification_type = notification_type
+        self.batch_size = batch_size or app.config['NOTIFICATION_BATCH_SIZE']
+        self.max_seconds = app.config['NOTIFICATION_BATCH_SECONDS'] if max_seconds is None else max_seconds
+        self.clock = clock
+        self.engine = db.engine  # The timer thread has no app context.
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flushed = clock()
+        self.stopped = threading.Event()
+        self.timer = None
+
+    def __enter__(self):
+        if self.max_seconds:
+            self.timer = threading.Thread(target=self._flush_on_time, name='notification-recorder', daemon=True)
+            self.timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        if self.timer:
+            self.timer.join()
+        self.flush()
+        db.session.expire_all()
+
+    def record(self, sample, error_message=None):
+        """Records an attempt to notify the sample, successful unless there is an error_message."""
+        with self.lock:
+            self.pending.append((sample.barcode, error_message is None, error_message, datetime.now(pytz.utc)))
+            due = len(self.pending) >= self.batch_size
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes everything recorded so far.  If that fails, the outcomes are kept to try again."""
+        with self.lock:
+            if not self.pending:
+                self.flushed = self.clock()
+                return
+            outcomes = self.pending
+            notified = [barcode for barcode, successful, _, _ in outcomes if successful]
+            failed = [barcode for barcode, successful, _, _ in outcomes if not successful]
+            start = time.perf_counter()
+            failed_column = getattr(Sample, f'{self.notification_type}_failed')
+            notified_column = getattr(Sample, f'{self.notification_type}_notified')
+            notified_on_column = getattr(Sample, f'{self.notification_type}_notified_on')
+            with self.engine.begin() as connection:
+                connection.execute(Notification.__table__.insert(), [
+                    {'sample_barcode': barcode, 'type': self.notification_type, 'successful': successful,
+                     'error_message': error_message, 'date': date}
+                    for barcode, successful, error_message, date in outcomes])
+                # Failures first, in case a sample failed and then went through in the same batch.
+                if failed:
+                    connection.execute(update(Sample.__table__).where(Sample.barcode.in_(failed))
+                                       .values({failed_column: True}))
+                if notified:
+                    # Only the first time it went through counts, for how long they waited.
+                    sent_on = case(value=Sample.barcode,
+                                   whens={barcode: date for barcode, successful, _, date in outcomes if successful})
+                    connection.execute(update(Sample.__table__).where(Sample.barcode.in_(notified))
+                                       .values({failed_column: False, notified_column: True,
+                                                notified_on_column: func.coalesce(notified_on_column, sent_on)}))
+                outbox = NotificationOutbox.__table__
+                connection.execute(outbox.delete()
+                                   .where(outbox.c.type == self.notification_type)
+                                   .where(outbox.c.sample_barcode.in_(notified + failed)))
+            self.pending = []
+            self.flushed = self.clock()
+            metrics.observe(f'{self.notification_type}_record_seconds', time.perf_counter() - start)
+
+    def _flush_on_time(self):
+        while not self.stopped.wait(self.max_seconds / 10):
+            if self.clock() - self.flushed >= self.max_seconds:
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception("Failed to record notifications, will try again.")
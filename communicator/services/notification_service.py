@@ -1,15 +1,12 @@
 import smtplib
 import uuid
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
 from email.header import Header
-from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import re
-from os.path import join
 
 import dateutil
-import phonenumbers
 import pytz
 from flask import render_template
 from pytz import timezone
@@ -18,6 +15,11 @@ from twilio.rest import Client
 from communicator import app, db
 from communicator.errors import CommError
 from communicator.models.invitation import Invitation
+from communicator.models.invitation_batch import InvitationBatch, SENT, FAILED
+from communicator.models.sample import normalize_phone
+from communicator.services.email_builder import ResultEmailBuilder, logo_image
+from communicator.services.email_dispatcher import EmailDispatcher
+from communicator.services.smtp_pool import SmtpConnectionPool
 
 TEST_MESSAGES = []
 
@@ -37,30 +39,43 @@ class NotificationService(object):
         self.app = app
         self.sender = app.config['MAIL_SENDER']
         self.URL_ROOT = app.config['URL_ROOT']
+        self.result_email_builder = None
 
     def __enter__(self):
         if 'TESTING' in self.app.config and self.app.config['TESTING']:
             return self
-        self.email_server = self._get_email_server()
         self.twilio_client = self._get_twilio_client()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if 'TESTING' in self.app.config and self.app.config['TESTING']:
-            return
-        self.email_server.close()
-        # No way to close the twilio client that I can see.
+        # Email connections are left open in the email_pool for next time, and there is no way to
+        # close the twilio client that I can see.
+        pass
 
     def get_link(self, sample):
         return f"https://besafe.virginia.edu/result-demo?code={sample.result_code}"
 
     def send_result_sms(self, sample):
+        phone_number, message = self.build_result_sms(sample)
+        if 'TESTING' in self.app.config and self.app.config['TESTING']:
+            TEST_MESSAGES.append(message)
+        else:
+            message = self.twilio_client.messages.create(
+                to=phone_number,
+                from_=self.app.config['TWILIO_NUMBER'],
+                body=message)
+
+    def build_result_sms(self, sample):
+        """Returns the number (in E.164 format) and text of the sample's result SMS.  The number is
+        normalized as samples are loaded, but samples built by hand are normalized here."""
         link = self.get_link(sample)
 
-        phone_number = phonenumbers.parse(sample.phone, "US")
-        if not phonenumbers.is_valid_number(phone_number):
+        if sample.phone_valid is None:
+            phone_number_string, valid = normalize_phone(sample.phone)
+        else:
+            phone_number_string, valid = sample.phone_e164, sample.phone_valid
+        if not valid:
             raise CommError(6001, f"invalid phone number: {sample.phone}")
-        phone_number_string = phonenumbers.format_number(phone_number, phonenumbers.PhoneNumberFormat.E164)
         if sample.email and '@' in sample.email:
             name = sample.email.split('@')[0]
         else:
@@ -68,37 +83,64 @@ class NotificationService(object):
 
         message = f"Dear {name}, You have an important notification from UVA, please visit: {link}. " \
                   f"Reply 'STOP' to opt-out."
-
-        if 'TESTING' in self.app.config and self.app.config['TESTING']:
-            TEST_MESSAGES.append(message)
-        else:
-            message = self.twilio_client.messages.create(
-                to=phone_number_string,
-                from_=self.app.config['TWILIO_NUMBER'],
-                body=message)
+        return phone_number_string, message
 
     def send_result_email(self, sample):
-        link = self.get_link(sample)
-        subject = "UVA: BE SAFE Notification"
         tracking_code = self._tracking_code()
-        text_body = render_template("emails/result_email.txt",
-                                    link=link,
-                                    base_url=self.URL_ROOT,
-                                    sample=sample,
-                                    tracking_code=tracking_code)
-
-        html_body = render_template("emails/result_email.html",
-                                    link=link,
-                                    base_url=self.URL_ROOT,
-                                    sample=sample,
-                                    tracking_code=tracking_code)
-
-        self._send_email(subject, recipients=[sample.email], text_body=text_body, html_body=html_body)
-
+        self.deliver(self.build_result_email(sample, tracking_code), [sample.email])
         return tracking_code
 
+    def build_result_email(self, sample, tracking_code=None):
+        """Builds the result email for the sample, ready to be delivered."""
+        if tracking_code is None:
+            tracking_code = self._tracking_code()
+        if self.result_email_builder is None:
+            self.result_email_builder = ResultEmailBuilder(self.sender, self.URL_ROOT)
+        return self.result_email_builder.build(sample.email, self.get_link(sample), tracking_code)
+
     def send_invitations(self, date, location, email_string):
-        emails = email_string.splitlines()
+        """Invites everyone in email_string (one address per line). They are BCC'd in batches of
+        MAIL_MAX_RECIPIENTS, as relays limit the recipients of a message, and the batches go out in
+        parallel.  Returns the Invitation, with the status of each batch."""
+        emails = list(dict.fromkeys(email.strip() for email in email_string.splitlines() if email.strip()))
+        size = self.app.config['MAIL_MAX_RECIPIENTS']
+        invitation = Invitation(location=location, date=date, total_recipients=len(emails))
+        invitation.batches = [InvitationBatch(recipients='\n'.join(emails[i:i + size]))
+                              for i in range(0, len(emails), size)]
+        db.session.add(invitation)
+        db.session.commit()
+        self.send_invitation_batches(invitation)
+        return invitation
+
+    def send_invitation_batches(self, invitation):
+        """Sends the batches of an invitation that haven't gone out yet, such as those that failed
+        last time, recording how each one went."""
+        batches = [batch for batch in invitation.batches if batch.status != SENT]
+        if not batches:
+            return
+        message = self._build_invitation(invitation.date, invitation.location)
+        message.as_bytes()  # Sets the MIME boundaries, before the message is shared between threads.
+        first = invitation.batches[0]
+
+        def messages():
+            for batch in batches:
+                # We get a copy, as we did when everyone was sent the one message.
+                yield batch, message, batch.recipient_list + ([self.sender] if batch is first else [])
+
+        with EmailDispatcher(self) as dispatcher:
+            for batch, error in dispatcher.send(messages()):
+                batch.attempts += 1
+                if error is None:
+                    batch.status = SENT
+                    batch.error_message = None
+                    batch.date_sent = datetime.now(pytz.utc)
+                else:
+                    self.app.logger.error(f'Failed to send invitation batch {batch.id}', exc_info=error)
+                    batch.status = FAILED
+                    batch.error_message = str(error)
+                db.session.commit()
+
+    def _build_invitation(self, date, location):
         subject = "UVA: BE SAFE - Appointment"
         tracking_code = self._tracking_code()
         text_body = render_template("invitation_email.txt",
@@ -113,15 +155,15 @@ class NotificationService(object):
                                     base_url=self.URL_ROOT,
                                     tracking_code=tracking_code)
 
-        self._send_email(subject, recipients=[self.sender], bcc=emails, text_body=text_body, html_body=html_body)
-
-        invitation_log = Invitation(location=location, date=date, total_recipients=len(emails))
-        db.session.add(invitation_log)
-        db.session.commit()
+        return self._build_email(subject, [self.sender], text_body, html_body)
 
     def _tracking_code(self):
         return str(uuid.uuid4())[:16]
 
+    def email_pool(self):
+        """The SMTP connections shared by everything sending email in this process."""
+        return SmtpConnectionPool.shared(self._get_email_server, self.app.config)
+
     def _get_email_server(self):
 
         server = smtplib.SMTP(host=self.app.config['MAIL_SERVER'],
@@ -140,6 +182,10 @@ class NotificationService(object):
                       self.app.config['TWILIO_TOKEN'])
 
     def _send_email(self, subject, recipients, text_body, html_body, bcc=[], sender=None, ical=None):
+        message = self._build_email(subject, recipients, text_body, html_body, sender=sender, ical=ical)
+        self.deliver(message, recipients + bcc)
+
+    def _build_email(self, subject, recipients, text_body, html_body, sender=None, ical=None):
         msgRoot = MIMEMultipart('related')
         msgRoot.set_charset('utf8')
 
@@ -161,13 +207,7 @@ class NotificationService(object):
         msgAlternative.attach(part2)
 
         # Embed the logo image
-        # This example assumes the image is in the current directory
-        fp = open(join(app.root_path, 'static', 'assets', 'img', 'brand', 'uva_logo.png'), 'rb')
-        msgImage = MIMEImage(fp.read())
-        fp.close()
-        # Define the image's ID as referenced above
-        msgImage.add_header('Content-ID', '<logo>')
-        msgRoot.attach(msgImage)
+        msgRoot.attach(logo_image())
 
         # Leaving this on here, just in case we need it later.
         if ical:
@@ -176,18 +216,38 @@ class NotificationService(object):
             ical_atch.add_header('Content-Disposition', 'attachment; filename=event.ics')
             msgRoot.attach(ical_atch)
 
+        return msgRoot
+
+    def deliver(self, message, recipients, email_server=None):
+        """Sends a message built by _build_email, over the given SMTP connection (by default, one
+        from the email_pool)."""
         if 'TESTING' in self.app.config and self.app.config['TESTING']:
-            print("TEST:  Recording Emails, not sending - %s - to:%s" % (subject, recipients))
-            TEST_MESSAGES.append(msgRoot)
+            print("TEST:  Recording Emails, not sending - %s - to:%s" % (message['Subject'], recipients))
+            TEST_MESSAGES.append(message)
             return
 
-        all_recipients = recipients + bcc
-        self.email_server.sendmail(sender, all_recipients, msgRoot.as_bytes())
+        if email_server is None:
+            self.email_pool().send(lambda server: self.deliver(message, recipients, server))
+            return
+        # smtplib sends bytes as they are, so the line endings must already be CRLF, or strict relays
+        # see the whole message as one (too long) line.
+        email_server.sendmail(message['From'], recipients,
+                              message.as_bytes(policy=message.policy.clone(linesep='\r\n')))
 
-    def is_reasonable_hour_for_text_messages(self):
+    def is_reasonable_hour_for_text_messages(self, now=None):
         """Where 'reasaonable' is between 8am and 10pm. """
+        return self.text_window_opens(now) is None
+
+    @staticmethod
+    def text_window_opens(now=None):
+        """None if it is a reasonable time for a text now, otherwise when it will be (the next
+        8am Eastern)."""
         tz = pytz.timezone('US/Eastern')
-        now = (datetime.now(tz))
-        eight_am = (datetime.now(tz).replace(hour=8, minute=0, second=0, microsecond=0))
-        ten_pm = (datetime.now(tz).replace(hour=22, minute=0, second=0, microsecond=0))
-        return eight_am <= now <= ten_pm
+        now = (now or datetime.now(pytz.utc)).astimezone(tz)
+        eight_am = tz.localize(datetime.combine(now.date(), time(8)))
+        ten_pm = tz.localize(datetime.combine(now.date(), time(22)))
+        if eight_am <= now <= ten_pm:
+            return None
+        if now > ten_pm:
+            eight_am = tz.localize(datetime.combine(now.date() + timedelta(days=1), time(8)))
+        return eight_am
@@ -0,0 +1,134 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import select, literal, or_, func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from communicator import app, db
+from communicator.models.notification import Notification
+from communicator.models.notification_outbox import NotificationOutbox
+from communicator.models.sample import Sample
+
+
+class OutboxService(object):
+    """Shares out the samples waiting in the notification outbox, so several notifiers, in any
+    number of processes, can send at once without sending anyone the same message twice.  Each
+    worker leases NOTIFICATION_LEASE_SIZE samples at a time with SELECT ... FOR UPDATE SKIP LOCKED,
+    so workers never wait on each other, and NotificationRecorder removes each sample from the
+    outbox along with its outcome. A lease runs out after NOTIFICATION_LEASE_SECONDS, which must be
+    longer than it takes to send a batch, and the samples are leased again.  A sample leased
+    NOTIFICATION_MAX_ATTEMPTS times without an outcome (it keeps killing the notifier, say) is
+    recorded as a failure, and taken out of the outbox, to be tried again only with retry."""
+
+    def __init__(self, notification_type, lease_size=None, lease_seconds=None, max_attempts=None):
+        self.notification_type = notification_type
+        self.lease_size = lease_size or app.config['NOTIFICATION_LEASE_SIZE']
+        self.lease_seconds = lease_seconds or app.config['NOTIFICATION_LEASE_SECONDS']
+        self.max_attempts = max_attempts or app.config['NOTIFICATION_MAX_ATTEMPTS']
+        self.owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    @staticmethod
+    def depth(notification_type):
+        """How many samples are waiting in the outbox, and the soonest any of those held back can
+        be sent."""
+        outbox = NotificationOutbox.__table__
+        held_back = func.min(outbox.c.not_before).filter(outbox.c.not_before > func.now())
+        return db.session.execute(select([func.count(), held_back])
+                                  .where(outbox.c.type == notification_type)).first()
+
+    @staticmethod
+    def enqueue(notification_type, file_name=None, retry=False, not_before=None):
+        """Adds the samples waiting to be notified to the outbox, unless they are already there,
+        returning how many were added. They can't be leased before not_before, if given. Does not
+        commit."""
+        waiting = select([Sample.barcode, literal(notification_type),
+                          literal(not_before, NotificationOutbox.not_before.type)])\
+            .where(Sample.waiting_for(notification_type, retry))
+        if file_name:
+            waiting = waiting.where(Sample.ivy_file == file_name)
+        statement = insert(NotificationOutbox.__table__)\
+            .from_select(['sample_barcode', 'type', 'not_before'], waiting)\
+            .on_conflict_do_nothing()
+        return db.session.execute(statement).rowcount
+
+    def lease(self, file_name=None):
+        """Leases the next batch of samples, committing so other workers see the lease at once.
+        Returns an empty list when there is nothing left to lease."""
+        outbox = NotificationOutbox.__table__
+        while True:
+            self._give_up()
+            available = select([outbox.c.id])\
+                .where(outbox.c.type == self.notification_type)\
+                .where(or_(outbox.c.leased_until == None, outbox.c.leased_until < func.now()))\
+                .where(or_(outbox.c.not_before == None, outbox.c.not_before <= func.now()))\
+                .where(outbox.c.attempts < self.max_attempts)
+            if file_name:
+                available = available.where(
+                    outbox.c.sample_barcode.in_(select([Sample.barcode]).where(Sample.ivy_file == file_name)))
+            available = available.order_by(outbox.c.id).limit(self.lease_size).with_for_update(skip_locked=True)
+            leased = db.session.execute(
+                outbox.update()
+                .where(outbox.c.id.in_(available))
+                .values(lease_owner=self.owner,
+                        leased_until=func.now() + timedelta(seconds=self.lease_seconds),
+                        attempts=outbox.c.attempts + 1)
+                .returning(outbox.c.sample_barcode)).fetchall()
+            db.session.commit()
+            if not leased:
+                return []
+
+            barcodes = {row.sample_barcode for row in leased}
+            samples = db.session.query(Sample)\
+                .filter(Sample.barcode.in_(barcodes))\
+                .filter(Sample.waiting_for(self.notification_type, retry=True))\
+                .all()
+            if len(samples) < len(barcodes):
+                # Notified some other way since they were added, they can go.
+                self._remove(barcodes - {sample.barcode for sample in samples})
+            if samples:
+                return samples
+
+    def release(self, failed=False):
+        """Gives up the leases we still hold, on the samples we didn't get to, so others can have
+        them straight away.  Those leases don't count as attempts, unless the run failed part way,
+        as we can't tell which sample was to blame."""
+        outbox = NotificationOutbox.__table__
+        db.session.execute(outbox.update()
+                           .where(outbox.c.lease_owner == self.owner)
+                           .values(lease_owner=None, leased_until=None,
+                                   attempts=outbox.c.attempts - (0 if failed else 1)))
+        db.session.commit()
+
+    def _give_up(self):
+        """Records a failure for each sample in the outbox that has been leased max_attempts times,
+        and whose last lease has run out, and removes it from the outbox."""
+        outbox = NotificationOutbox.__table__
+        exhausted = select([outbox.c.id])\
+            .where(outbox.c.type == self.notification_type)\
+            .where(or_(outbox.c.leased_until == None, outbox.c.leased_until < func.now()))\
+            .where(outbox.c.attempts >= self.max_attempts)\
+            .with_for_update(skip_locked=True)
+        barcodes = [row.sample_barcode for row in db.session.execute(
+            outbox.delete().where(outbox.c.id.in_(exhausted)).returning(outbox.c.sample_barcode))]
+        if barcodes:
+            error_message = f"Gave up after {self.max_attempts} attempts without an outcome."
+            app.logger.error(f"{error_message} {len(barcodes)} {self.notification_type} notification(s): {barcodes}")
+            now = datetime.now(pytz.utc)
+            db.session.execute(Notification.__table__.insert(), [
+                {'sample_barcode': barcode, 'type': self.notification_type, 'successful': False,
+                 'error_message': error_message, 'date': now}
+                for barcode in barcodes])
+            db.session.execute(update(Sample.__table__).where(Sample.barcode.in_(barcodes))
+                               .values({getattr(Sample, f'{self.notification_type}_failed'): True}))
+        db.session.commit()
+        return barcodes
+
+    def _remove(self, barcodes):
+        outbox = NotificationOutbox.__table__
+        db.session.execute(outbox.delete()
+                           .where(outbox.c.type == self.notification_type)
+                           .where(outbox.c.sample_barcode.in_(barcodes)))
+        db.session.commit()
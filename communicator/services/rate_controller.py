@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pytz
+from sqlalchemy.exc import IntegrityError
+
+from communicator import db
+from communicator.models.rate_limit_state import RateLimitState
+from communicator.services.rate_limiter import RateLimiter, TokenBucket
+
+
+class AdaptiveRateController(object):
+    """A rate limiter that learns how fast the relay will let us go.  When we are throttled (a 451,
+    or a dropped connection) the rate is halved and nothing is sent until a backoff period has
+    passed, the backoff doubling if we are throttled again soon after.  After every
+    'increase_after' messages sent without trouble, the rate goes up by 10%, up to 'max_rate'.
+
+    The current rate and backoff are kept in the rate_limit_state table, so that separate runs
+    and workers share one view of the relay.  They are read and written on a connection of their
+    own, as NotificationRecorder does, rather than committing the session, which would expire the
+    samples still on their way out.  acquire() may be called from any thread, and on_success() and
+    on_throttle() from one thread at a time."""
+
+    INCREASE = 1.1
+    RECENT_SECONDS = 10
+    REFRESH_SECONDS = 30
+
+    def __init__(self, name, max_rate=None, min_rate=0.1, per_hour=None, backoff_seconds=30,
+                 max_backoff_seconds=900, increase_after=100, clock=time.time, sleep=time.sleep):
+        self.name = name
+        self.max_rate = max_rate or None
+        self.min_rate = min_rate
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.increase_after = increase_after
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.hourly = RateLimiter(per_hour=per_hour, clock=clock, sleep=sleep)
+        self.successes = 0
+        self.recent = deque()  # When recent messages were sent, to estimate our rate when unlimited.
+        self.refreshed = clock()
+        self.engine = db.engine
+        self.table = RateLimitState.__table__
+
+        state = self._load()
+        if state is None:
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(self.table.insert().values(name=name, rate=self.max_rate, throttle_count=0))
+            except IntegrityError:
+                pass  # Another worker got there first.
+            state = self._load()
+        self.rate = self._clamp(state.rate)
+        self.backoff_until = self._timestamp(state.backoff_until)
+        self.throttle_count = state.throttle_count or 0
+        self.last_throttled = None if state.last_throttled is None else self._timestamp(state.last_throttled)
+        self.bucket = self._bucket()
+
+    def acquire(self):
+        """Blocks until a message may be sent."""
+        while True:
+            with self.lock:
+                wait = self.backoff_until - self.clock()
+                if wait <= 0 and self.bucket:
+                    wait = self.bucket.wait_time()
+                if wait <= 0:
+                    if self.bucket:
+                        self.bucket.take()
+                    break
+            self.sleep(wait)
+        self.hourly.acquire()
+
+    def on_success(self):
+        with self.lock:
+            now = self.clock()
+            self.recent.append(now)
+            while self.recent[0] < now - self.RECENT_SECONDS:
+                self.recent.popleft()
+            self.successes += 1
+            increase = self.rate is not None and self.successes >= self.increase_after
+            if increase:
+                self.successes = 0
+                self._set_rate(self.rate * self.INCREASE)
+        if increase:
+            self._save()
+        elif now - self.refreshed > self.REFRESH_SECONDS:
+            self._refresh()
+
+    def on_throttle(self):
+        """Slows down, and backs off, returning the number of seconds we will wait.  A throttle
+        that arrives while we are already backing off (other messages that were in flight) is
+        not counted again, and returns None."""
+        with self.lock:
+            now = self.clock()
+            if now < self.backoff_until:
+                return None
+            if self.rate is None:
+                observed = len(self.recent) / self.RECENT_SECONDS
+                self._set_rate(observed / 2)
+            else:
+                self._set_rate(self.rate / 2)
+            recently_throttled = self.last_throttled is not None and \
+                now - self.last_throttled < self.max_backoff_seconds
+            backoff = min(self.max_backoff_seconds,
+                          self.backoff_seconds * 2 ** (self.throttle_count if recently_throttled else 0))
+            self.backoff_until = now + backoff
+            self.successes = 0
+            self.recent.clear()
+            self.throttle_count = self.throttle_count + 1 if recently_throttled else 1
+            self.last_throttled = now
+        self._save()
+        return backoff
+
+    def _set_rate(self, rate):
+        self.rate = self._clamp(rate)
+        self.bucket = self._bucket()
+
+    def _clamp(self, rate):
+        if rate is None:
+            return self.max_rate
+        rate = max(self.min_rate, rate)
+        return min(self.max_rate, rate) if self.max_rate else rate
+
+    def _bucket(self):
+        if self.rate is None:
+            return None
+        bucket = TokenBucket(self.rate, 1, self.clock)
+        bucket.tokens = 1
+        return bucket
+
+    def _load(self):
+        with self.engine.connect() as connection:
+            return connection.execute(self.table.select().where(self.table.c.name == self.name)).first()
+
+    def _save(self):
+        with self.lock:
+            values = {'rate': self.rate,
+                      'backoff_until': self._datetime(self.backoff_until) if self.backoff_until else None,
+                      'throttle_count': self.throttle_count,
+                      'last_throttled': None if self.last_throttled is None else self._datetime(self.last_throttled),
+                      'updated': self._datetime(self.clock())}
+        with self.engine.begin() as connection:
+            connection.execute(self.table.update().where(self.table.c.name == self.name).values(values))
+        self.refreshed = self.clock()
+
+    def _refresh(self):
+        """Picks up any changes made by other runs and workers."""
+        state = self._load()
+        with self.lock:
+            self._set_rate(state.rate)
+            self.backoff_until = max(self.backoff_until, self._timestamp(state.backoff_until))
+            self.throttle_count = state.throttle_count or 0
+            if state.last_throttled is not None:
+                self.last_throttled = max(self.last_throttled or 0, self._timestamp(state.last_throttled))
+        self.refreshed = self.clock()
+
+    @staticmethod
+    def _datetime(timestamp):
+        return datetime.fromtimestamp(timestamp, pytz.utc)
+
+    @staticmethod
+    def _timestamp(date):
+        return date.timestamp() if date else 0
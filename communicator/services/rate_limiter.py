@@ -0,0 +1,52 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Holds up to 'capacity' tokens, refilled at 'rate' tokens per second."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def wait_time(self):
+        """The number of seconds until a token is available, 0 if there is one now."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 - 1e-9:  # Allow for rounding, or we could wait forever on a tiny fraction.
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter(object):
+    """Limits how many messages we send, per second and per hour, so we can go exactly as fast as
+    the mail relay allows.  A rate of 0 (or None) is no limit.  Safe to share between threads,
+    acquire() blocks until the message may be sent."""
+
+    def __init__(self, per_second=None, per_hour=None, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.buckets = []
+        if per_second:
+            self.buckets.append(TokenBucket(per_second, max(1, per_second), clock))
+        if per_hour:
+            self.buckets.append(TokenBucket(per_hour / 3600, per_hour, clock))
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                # A token is only taken when every bucket has one to give.
+                wait = max([bucket.wait_time() for bucket in self.buckets], default=0)
+                if wait == 0:
+                    for bucket in self.buckets:
+                        bucket.take()
+                    return
+            self.sleep(wait)
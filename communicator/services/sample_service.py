@@ -1,22 +1,172 @@
 import re
 from datetime import datetime
 
-from sqlalchemy import func
+from sqlalchemy import func, or_, literal_column, case, tuple_
+from sqlalchemy.dialects.postgresql import insert
 
 from communicator import db, app
 from communicator.models.sample import Sample
 import random
 
 
+class UpsertCounts(object):
+    """How many of the records loaded were new, changed existing samples, or left them unchanged.
+    Records for a barcode that appeared earlier in the same batch are merged into that earlier
+    record before it is loaded, and counted as duplicates."""
+
+    def __init__(self, new=0, changed=0, unchanged=0, duplicates=0):
+        self.new = new
+        self.changed = changed
+        self.unchanged = unchanged
+        self.duplicates = duplicates
+
+    @property
+    def total(self):
+        return self.new + self.changed + self.unchanged + self.duplicates
+
+    def __add__(self, other):
+        return UpsertCounts(self.new + other.new, self.changed + other.changed, self.unchanged + other.unchanged,
+                            self.duplicates + other.duplicates)
+
+    def __str__(self):
+        return f"{self.new} new, {self.changed} changed, {self.unchanged} unchanged, {self.duplicates} duplicates"
+
+
 class SampleService(object):
     """Handles the collection and syncing of data from various sources. """
 
     def add_or_update_records(self, samples):
-        for sample in samples:
+        """Adds the samples to the database, merging them into any existing records with the same
+        barcode.  Uses a single set based upsert on Postgres, and falls back to merging records one
+        at a time on other databases (such as SQLite). Samples that would not change are not
+        written at all. Returns UpsertCounts."""
+        if db.engine.dialect.name == 'postgresql':
+            return self.upsert_records(samples)
+        else:
+            return self.merge_records(samples)
+
+    def waiting_for_notification(self, notification_type, file_name=None, retry=False, page_size=None):
+        """Generates pages of the samples waiting to be notified, NOTIFICATION_PAGE_SIZE at a time.
+        Pages are read in (created_on, barcode) order, each one picking up after the last sample of
+        the one before, so samples notified in the meantime don't shift the pages about, and each
+        page is expunged from the session when the next one is asked for, so memory use stays
+        the same however many are waiting. Samples are still usable after they are expunged, but
+        changes to them are no longer saved."""
+        page_size = page_size or app.config['NOTIFICATION_PAGE_SIZE']
+        query = db.session.query(Sample).filter(Sample.waiting_for(notification_type, retry))
+        if file_name:
+            query = query.filter(Sample.ivy_file == file_name)
+        order = (Sample.created_on, Sample.barcode)
+        page = query.order_by(*order).limit(page_size).all()
+        while page:
+            try:
+                yield page
+            finally:
+                for sample in page:
+                    if sample in db.session:
+                        db.session.expunge(sample)
+            if len(page) < page_size:
+                return
+            last = page[-1]
+            page = query.filter(tuple_(*order) > tuple_(last.created_on, last.barcode))\
+                .order_by(*order).limit(page_size).all()
+
+    def merge_records(self, samples):
+        """The original, row by row, approach - looks up each sample, and merges it into an existing
+        record if one exists."""
+        merged = self._merge_duplicates(samples)
+        counts = UpsertCounts(duplicates=len(samples) - len(merged))
+        for sample in merged:
             existing = db.session.query(Sample).filter(Sample.barcode == sample.barcode).first()
-            if existing is not None:
-                existing.merge(sample)
+            if existing is None:
+                db.session.add(sample)
+                counts.new += 1
+            elif existing.merge(sample):
                 db.session.add(existing)
+                counts.changed += 1
             else:
-                db.session.add(sample)
+                counts.unchanged += 1
         db.session.commit()
+        return counts
+
+    def upsert_records(self, samples, chunk_size=None):
+        """Loads all the samples with INSERT ... ON CONFLICT (barcode) DO UPDATE statements, applying
+        the same rules as Sample.merge to any records that already exist. Postgres only."""
+        if chunk_size is None:
+            chunk_size = app.config['SAMPLE_UPSERT_CHUNK_SIZE']
+        rows = [self._values(s) for s in self._merge_duplicates(samples)]
+        counts = UpsertCounts(duplicates=len(samples) - len(rows))
+        for i in range(0, len(rows), chunk_size):
+            counts += self.count_upserts(db.session.execute(self._upsert_statement(rows[i:i + chunk_size])))
+        db.session.commit()
+        counts.unchanged = len(rows) - counts.new - counts.changed
+        return counts
+
+    @staticmethod
+    def count_upserts(result):
+        """Counts the rows returned by an upsert statement, those that were inserted, or changed."""
+        counts = UpsertCounts()
+        for row in result:
+            if row.inserted:
+                counts.new += 1
+            else:
+                counts.changed += 1
+        return counts
+
+    @staticmethod
+    def _merge_duplicates(samples):
+        """Collapses any duplicate barcodes within the batch, merging later records into (copies of)
+        earlier ones just as they would be if they were added one at a time. Postgres will not update
+        the same row twice in a single statement, and it keeps the counts the same on every path."""
+        by_barcode = {}
+        for sample in samples:
+            if sample.barcode in by_barcode:
+                by_barcode[sample.barcode].merge(sample)
+            else:
+                by_barcode[sample.barcode] = Sample(**SampleService._values(sample))
+        return list(by_barcode.values())
+
+    @staticmethod
+    def _values(sample):
+        """Returns a dictionary of every column value for the sample, filling in the column
+        defaults, as every row in a multi-row insert must have the same keys."""
+        values = {}
+        for column in Sample.__table__.columns:
+            value = getattr(sample, column.key)
+            if value is None and column.default is not None:
+                value = column.default.arg(None) if column.default.is_callable else column.default.arg
+            values[column.key] = value
+        return values
+
+    @staticmethod
+    def upsert_set_clause(excluded):
+        """The SET clause of an upsert into the sample table, mirroring the rules in Sample.merge,
+        'excluded' is the set of incoming values."""
+        table = Sample.__table__
+        set_clause = {}
+        for column in Sample.MERGED_COLUMNS:
+            set_clause[column] = func.coalesce(func.nullif(excluded[column], ''), table.c[column])
+        for column in Sample.MERGED_FLAGS:
+            set_clause[column] = or_(table.c[column], excluded[column])
+        for column in Sample.PHONE_COLUMNS:
+            set_clause[column] = case([(func.nullif(excluded.phone, '') != None, excluded[column])],
+                                      else_=table.c[column])
+        for column in Sample.FIRST_COLUMNS:
+            set_clause[column] = func.coalesce(table.c[column], excluded[column])
+        return set_clause
+
+    @staticmethod
+    def on_conflict_merge(statement):
+        """Adds the ON CONFLICT clause to an insert into the sample table, merging the new values into
+        existing records.  Records are only updated (and their last_modified date bumped) if their
+        values would actually change. Returns the inserted and updated rows, with an 'inserted' flag."""
+        table = Sample.__table__
+        set_clause = SampleService.upsert_set_clause(statement.excluded)
+        changed = or_(*[table.c[column].is_distinct_from(value) for column, value in set_clause.items()])
+        set_clause['last_modified'] = datetime.now()
+        return statement.on_conflict_do_update(index_elements=['barcode'], set_=set_clause, where=changed)\
+            .returning(table.c.barcode, literal_column('(xmax = 0)').label('inserted'))
+
+    @staticmethod
+    def _upsert_statement(rows):
+        return SampleService.on_conflict_merge(insert(Sample.__table__).values(rows))
@@ -0,0 +1,113 @@
+import asyncio
+import queue
+import threading
+import time
+
+import aiohttp
+
+from communicator.errors import CommError
+from communicator.services.metrics import metrics
+from communicator.services.notification_service import TEST_MESSAGES
+from communicator.services.rate_limiter import TokenBucket
+
+
+class SmsDispatcher(object):
+    """Sends text messages through Twilio's REST API, up to TWILIO_CONCURRENCY at once and no faster
+    than TWILIO_RATE_PER_SECOND (what the account allows), from an asyncio event loop running on a
+    background thread.  If Twilio tells us we are going too fast (a 429), the message is tried again
+    after the pause it asks for.  While TESTING, messages are only recorded in TEST_MESSAGES, unless
+    an api_url is given.
+    ex:
+
+    dispatcher = SmsDispatcher(app)
+    for sample, error in dispatcher.send(messages):
+        ...
+    """
+
+    MAX_RETRIES = 3
+
+    def __init__(self, app, concurrency=None, rate_per_second=None, api_url=None):
+        config = app.config
+        self.concurrency = concurrency or config['TWILIO_CONCURRENCY']
+        self.rate_per_second = config['TWILIO_RATE_PER_SECOND'] if rate_per_second is None else rate_per_second
+        self.testing = 'TESTING' in config and config['TESTING'] and api_url is None
+        self.url = f"{api_url or config['TWILIO_API_URL']}/2010-04-01/Accounts/{config['TWILIO_SID']}/Messages.json"
+        self.auth = aiohttp.BasicAuth(config['TWILIO_SID'], config['TWILIO_TOKEN'])
+        self.sender = config['TWILIO_NUMBER']
+        self.timeout = aiohttp.ClientTimeout(total=config['TWILIO_TIMEOUT'])
+        self.stopped = False
+
+    def send(self, messages):
+        """Sends the messages, a list of (key, phone number, text) tuples, yielding (key, error) for
+        each one as it completes, where error is None if it was sent.  The messages should be built
+        before hand, they are read on the event loop's thread.  Nothing more is sent once the caller
+        stops reading the results."""
+        self.stopped = False
+        results = queue.Queue()
+        thread = threading.Thread(target=asyncio.run, args=(self._send_all(messages, results),),
+                                  name='sms', daemon=True)
+        thread.start()
+        try:
+            while True:
+                result = results.get()
+                if result is None:
+                    break
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            self.stopped = True
+            thread.join()
+
+    async def _send_all(self, messages, results):
+        try:
+            messages = iter(messages)
+            bucket = TokenBucket(self.rate_per_second, max(1, self.rate_per_second)) if self.rate_per_second else None
+            async with aiohttp.ClientSession(auth=self.auth, timeout=self.timeout) as session:
+                await asyncio.gather(*[self._worker(session, messages, bucket, results)
+                                       for _ in range(self.concurrency)])
+        except Exception as e:
+            results.put(e)
+        else:
+            results.put(None)
+
+    async def _worker(self, session, messages, bucket, results):
+        """Each worker takes the next message as soon as it is done with the last, so no more than
+        'concurrency' requests are ever waiting on Twilio."""
+        for key, phone_number, text in messages:
+            if self.stopped:
+                return
+            await self._acquire(bucket)
+            start = time.perf_counter()
+            try:
+                await self._post(session, phone_number, text)
+                error = None
+            except Exception as e:
+                error = e
+            metrics.observe('text_send_seconds', time.perf_counter() - start)
+            results.put((key, error))
+
+    @staticmethod
+    async def _acquire(bucket):
+        if bucket is None:
+            return
+        wait = bucket.wait_time()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = bucket.wait_time()
+        bucket.take()
+
+    async def _post(self, session, phone_number, text):
+        if self.testing:
+            TEST_MESSAGES.append(text)
+            return
+        data = {'To': phone_number, 'From': self.sender, 'Body': text}
+        for attempt in range(self.MAX_RETRIES + 1):
+            async with session.post(self.url, data=data) as response:
+                if response.status == 429 and attempt < self.MAX_RETRIES:
+                    await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+                    continue
+                if response.status >= 400:
+                    raise CommError(6002, f"Twilio could not send the message to {phone_number}",
+                                    await response.text())
+                return
@@ -0,0 +1,138 @@
+import atexit
+import smtplib
+import threading
+import time
+
+
+class SmtpConnection(object):
+    """An open SMTP connection, and how long it has been open and how many messages it has sent."""
+
+    def __init__(self, server, opened):
+        self.server = server
+        self.opened = opened
+        self.last_used = opened
+        self.sent = 0
+
+
+class SmtpConnectionPool(object):
+    """Keeps authenticated SMTP connections open between runs, so we don't connect, EHLO, STARTTLS
+    and LOGIN for every batch of messages.  A connection that has been sitting idle for more than
+    MAIL_POOL_PROBE_SECONDS is checked with a NOOP before it is used again, and connections are
+    closed once they are MAIL_POOL_MAX_AGE seconds old, or have sent MAIL_POOL_MAX_MESSAGES, as
+    relays tend to drop long lived connections.  If the connection drops while sending, we reconnect
+    and try the message again, once.  Safe to share between threads.  Use shared() for the one
+    pool in this process.
+    ex:
+
+    pool = SmtpConnectionPool.shared(notifier._get_email_server, app.config)
+    pool.send(lambda server: server.sendmail(sender, recipients, message))
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, connect, max_idle=4, max_age=300, max_messages=100, probe_after=1,
+                 clock=time.monotonic):
+        self.connect = connect
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.probe_after = probe_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.idle = []
+
+    @classmethod
+    def shared(cls, connect, config):
+        """The pool for this process, created the first time it is asked for."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(connect,
+                                  max_idle=config['MAIL_POOL_SIZE'],
+                                  max_age=config['MAIL_POOL_MAX_AGE'],
+                                  max_messages=config['MAIL_POOL_MAX_MESSAGES'],
+                                  probe_after=config['MAIL_POOL_PROBE_SECONDS'])
+                atexit.register(cls._shared.close)
+            return cls._shared
+
+    def send(self, deliver):
+        """Calls deliver(server) with an open connection, returning what it returns.  If the
+        connection turns out to have been dropped, deliver is called again on a new one."""
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                result = deliver(connection.server)
+            except Exception as e:
+                if self.dropped(e) and attempt == 0:
+                    self.discard(connection)
+                    continue
+                self.release(connection, ok=self.connection_ok(e))
+                raise
+            connection.sent += 1
+            self.release(connection)
+            return result
+
+    def acquire(self):
+        """An open connection, one that has been checked, if it sat idle a while, or a new one."""
+        while True:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                return SmtpConnection(self.connect(), self.clock())
+            if self._expired(connection):
+                self.discard(connection)
+            elif self.clock() - connection.last_used < self.probe_after or self._alive(connection):
+                return connection
+
+    def release(self, connection, ok=True):
+        """Hands a connection back, to be used again, unless it is no longer any good."""
+        if not ok or self._expired(connection):
+            self.discard(connection)
+            return
+        connection.last_used = self.clock()
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        self.discard(connection)
+
+    def discard(self, connection):
+        try:
+            connection.server.quit()
+        except Exception:
+            connection.server.close()
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            self.discard(connection)
+
+    @staticmethod
+    def dropped(error):
+        """True if the connection was lost, rather than the server turning the message down."""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    @staticmethod
+    def connection_ok(error):
+        """True if the server rejected the message, but the connection can still be used."""
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return True
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code != 421
+
+    def _expired(self, connection):
+        return self.clock() - connection.opened >= self.max_age or connection.sent >= self.max_messages
+
+    def _alive(self, connection):
+        try:
+            alive = connection.server.noop()[0] == 250
+        except Exception:
+            alive = False
+        if not alive:
+            self.discard(connection)
+        return alive
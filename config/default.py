@@ -57,11 +57,53 @@ MAIL_USERNAME = environ.get('MAIL_USERNAME', default='')
 MAIL_PASSWORD = environ.get('MAIL_PASSWORD', default='')
 MAIL_SENDER = 'UVA Prevalence Testing <Prevalence-Test@virginia.edu>'
 MAIL_TIMEOUT = 10
+# Result emails are sent over this many SMTP connections at once, no faster than the rates below
+# allow (0 for no limit).
+MAIL_POOL_SIZE = int(environ.get('MAIL_POOL_SIZE', default=4))
+MAIL_RATE_PER_SECOND = float(environ.get('MAIL_RATE_PER_SECOND', default=2))
+MAIL_RATE_PER_HOUR = float(environ.get('MAIL_RATE_PER_HOUR', default=0))
+# Connections are kept open between runs, and checked with a NOOP if they have been idle longer than
+# MAIL_POOL_PROBE_SECONDS.  They are closed once they are MAIL_POOL_MAX_AGE seconds old, or have sent
+# MAIL_POOL_MAX_MESSAGES, before the relay decides to drop them.
+MAIL_POOL_MAX_AGE = float(environ.get('MAIL_POOL_MAX_AGE', default=300))
+MAIL_POOL_MAX_MESSAGES = int(environ.get('MAIL_POOL_MAX_MESSAGES', default=100))
+MAIL_POOL_PROBE_SECONDS = float(environ.get('MAIL_POOL_PROBE_SECONDS', default=1))
+# Invitations are BCC'd to at most this many recipients a message, the relay's limit.
+MAIL_MAX_RECIPIENTS = int(environ.get('MAIL_MAX_RECIPIENTS', default=100))
+# When the relay throttles us, the rate is halved (down to this minimum), and we wait this long before
+# trying again, doubling each time it happens again.  After this many messages go out without trouble,
+# the rate goes back up by 10% (up to MAIL_RATE_PER_SECOND).  A run stops after MAIL_MAX_THROTTLES.
+MAIL_RATE_MIN_PER_SECOND = float(environ.get('MAIL_RATE_MIN_PER_SECOND', default=0.1))
+MAIL_BACKOFF_SECONDS = float(environ.get('MAIL_BACKOFF_SECONDS', default=30))
+MAIL_RATE_INCREASE_AFTER = int(environ.get('MAIL_RATE_INCREASE_AFTER', default=100))
+MAIL_MAX_THROTTLES = int(environ.get('MAIL_MAX_THROTTLES', default=5))
+# The outcome of each email or text is recorded in batches of this many, or this often, whichever comes first.
+NOTIFICATION_BATCH_SIZE = int(environ.get('NOTIFICATION_BATCH_SIZE', default=100))
+NOTIFICATION_BATCH_SECONDS = float(environ.get('NOTIFICATION_BATCH_SECONDS', default=5))
+# Samples waiting to be notified are read this many at a time, so a notifier's memory use doesn't grow with the backlog.
+NOTIFICATION_PAGE_SIZE = int(environ.get('NOTIFICATION_PAGE_SIZE', default=500))
+# Samples are added to the notification outbox as results come in, and notifiers lease them from it this
+# many at a time, so several can run at once, on any number of nodes.  A lease must last longer than it
+# takes to send a batch.
+NOTIFICATION_OUTBOX = environ.get('NOTIFICATION_OUTBOX', default="false") == "true"
+NOTIFICATION_LEASE_SIZE = int(environ.get('NOTIFICATION_LEASE_SIZE', default=100))
+NOTIFICATION_LEASE_SECONDS = float(environ.get('NOTIFICATION_LEASE_SECONDS', default=600))
+# A sample leased this many times without an outcome (its notifier keeps dying) is recorded as a failure.
+NOTIFICATION_MAX_ATTEMPTS = int(environ.get('NOTIFICATION_MAX_ATTEMPTS', default=5))
 
 # Ivy Directory
 IVY_IMPORT_DIR = environ.get('IVY_IMPORT_DIR', default='')
 DELETE_IVY_FILES = environ.get('DELETE_IVY_FILES', default="false") == "true"
 
+# Samples are upserted into the database in chunks of this many rows per statement.
+SAMPLE_UPSERT_CHUNK_SIZE = int(environ.get('SAMPLE_UPSERT_CHUNK_SIZE', default=1000))
+# IVY files are read, and committed to the database, this many rows at a time to keep memory use flat.
+IVY_IMPORT_CHUNK_SIZE = int(environ.get('IVY_IMPORT_CHUNK_SIZE', default=5000))
+# When more than one, and several files are waiting, files are parsed in parallel on this many processes.
+IVY_IMPORT_WORKERS = int(environ.get('IVY_IMPORT_WORKERS', default=1))
+# Files with more rows than this are loaded with Postgres' COPY through a staging table (0 to disable).
+IVY_COPY_THRESHOLD_ROWS = int(environ.get('IVY_COPY_THRESHOLD_ROWS', default=50000))
+
 # NOT IN USE -- Globus endpoint connections - These are not currently used, setting defaults so we don't need to include them
 # in our Docker container.
 GLOBUS_CLIENT_ID = environ.get('GLOBUS_CLIENT_ID', default="NA")
@@ -72,10 +114,16 @@ GLOBUS_DTN_ENDPOINT = environ.get('GLOBUS_DTN_ENDPOINT', default="NA")
 GLOBUS_IVY_PATH = environ.get('GLOBUS_IVY_PATH', default="NA")
 GLOBUS_DTN_PATH = environ.get('GLOBUS_DTN_PATH', default="NA")
 
-# NOT IN USE --  Twilio SMS Messages
+# Twilio SMS Messages
 TWILIO_SID = environ.get('TWILIO_SID', default="NA")
 TWILIO_TOKEN = environ.get('TWILIO_TOKEN', default="NA")
 TWILIO_NUMBER =  environ.get('TWILIO_NUMBER', default="NA")
+TWILIO_API_URL = environ.get('TWILIO_API_URL', default="https://api.twilio.com")
+TWILIO_TIMEOUT = float(environ.get('TWILIO_TIMEOUT', default=30))
+# Result texts are sent this many at a time, no faster than the account's messages per second allows
+# (0 for no limit).
+TWILIO_CONCURRENCY = int(environ.get('TWILIO_CONCURRENCY', default=8))
+TWILIO_RATE_PER_SECOND = float(environ.get('TWILIO_RATE_PER_SECOND', default=10))
 
 # NOT IN USE --  Firestore configuration
 FIRESTORE_JSON = environ.get('FIRESTORE_JSON', default="NA")
@@ -83,6 +131,12 @@ FIRESTORE_JSON = environ.get('FIRESTORE_JSON', default="NA")
 # Scheduled tasks
 SCHEDULED_TASK_MINUTES = float(environ.get('SCHEDULED_TASK_MINUTES', default=1))
 RUN_SCHEDULED_TASKS = environ.get('RUN_SCHEDULED_TASKS', default="false") == "true"
+# Along with the scheduled tasks, watch the IVY_IMPORT_DIR and load files as soon as they arrive.
+IVY_WATCH_DIRECTORY = environ.get('IVY_WATCH_DIRECTORY', default="false") == "true"
+IVY_WATCH_DEBOUNCE_SECONDS = float(environ.get('IVY_WATCH_DEBOUNCE_SECONDS', default=5))
+# Poll the directory, rather than relying on inotify, required for network file systems.
+IVY_WATCH_POLL = environ.get('IVY_WATCH_POLL', default="false") == "true"
+IVY_WATCH_POLL_SECONDS = float(environ.get('IVY_WATCH_POLL_SECONDS', default=5))
 
 # Argon Settings
 CSRF_ENABLED = True
@@ -10,7 +10,7 @@ import unittest
 
 os.environ["TESTING"] = "true"
 
-from communicator.models import Sample
+from communicator.models import Sample, IvyFile, RateLimitState
 from communicator.models.notification import Notification
 
 
@@ -55,6 +55,8 @@ class BaseTest(unittest.TestCase):
     def tearDown(self):
         db.session.query(Notification).delete()
         db.session.query(Sample).delete()
+        db.session.query(IvyFile).delete()
+        db.session.query(RateLimitState).delete()
         executor.shutdown(wait=False)
         db.session.commit()
 
@@ -0,0 +1,49 @@
+import smtplib
+
+
+class FakeClock(object):
+    """A clock that only moves when a test moves it, or something sleeps on it.  Pass clock.time
+    and clock.sleep, or the clock itself, where a function returning the time is wanted."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeServer(object):
+    """Stands in for a connection to the SMTP relay.  Set 'alive' to False to act as though the
+    relay has hung up, or 'fail_with' to an error for every message to fail with."""
+
+    def __init__(self):
+        self.alive = True
+        self.fail_with = None
+        self.noops = 0
+        self.closed = False
+        self.sent = []
+
+    def noop(self):
+        self.noops += 1
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected()
+        return 250, b'OK'
+
+    def sendmail(self, message):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected()
+        if self.fail_with:
+            raise self.fail_with
+        self.sent.append(message)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
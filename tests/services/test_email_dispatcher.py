@@ -0,0 +1,73 @@
+import smtplib
+import threading
+from unittest.mock import MagicMock
+
+from tests.base_test import BaseTest
+from tests.fakes import FakeServer
+
+from communicator.services.email_dispatcher import EmailDispatcher
+from communicator.services.rate_limiter import RateLimiter
+from communicator.services.smtp_pool import SmtpConnectionPool
+
+
+class TestEmailDispatcher(BaseTest):
+
+    def get_notifier(self, servers):
+        notifier = MagicMock()
+        notifier.app.config = {'MAIL_POOL_SIZE': 3, 'MAIL_RATE_PER_SECOND': 0, 'MAIL_RATE_PER_HOUR': 0}
+        notifier.delivered = []
+        lock = threading.Lock()
+
+        def deliver(message, recipients, server):
+            if server.fail_with:
+                raise server.fail_with
+            with lock:
+                notifier.delivered.append((message, server))
+        notifier.deliver.side_effect = deliver
+        notifier.email_pool.return_value = SmtpConnectionPool(lambda: servers.append(FakeServer()) or servers[-1],
+                                                              max_idle=3)
+        return notifier
+
+    def test_messages_share_a_pool_of_connections(self):
+        servers = []
+        notifier = self.get_notifier(servers)
+        with EmailDispatcher(notifier) as dispatcher:
+            results = list(dispatcher.send((i, f"message {i}", ["a@b.edu"]) for i in range(50)))
+        self.assertEqual(list(range(50)), sorted(key for key, error in results))
+        self.assertTrue(all(error is None for key, error in results))
+        self.assertEqual(50, len(notifier.delivered))
+        self.assertLessEqual(len(servers), 3)
+        self.assertFalse(any(server.closed for server in servers))  # Kept open for next time.
+        with EmailDispatcher(notifier) as dispatcher:
+            list(dispatcher.send((i, f"message {i}", ["a@b.edu"]) for i in range(10)))
+        self.assertLessEqual(len(servers), 3)
+
+    def test_reconnects_and_resends_after_a_disconnect(self):
+        servers = []
+        notifier = self.get_notifier(servers)
+        with EmailDispatcher(notifier, pool_size=1) as dispatcher:
+            results = dict(dispatcher.send([(1, "message 1", ["a@b.edu"])]))
+            servers[0].fail_with = smtplib.SMTPServerDisconnected()
+            results.update(dispatcher.send([(2, "message 2", ["a@b.edu"]), (3, "message 3", ["a@b.edu"])]))
+        self.assertEqual({1: None, 2: None, 3: None}, results)
+        self.assertEqual(2, len(servers))
+        self.assertTrue(servers[0].closed)
+        self.assertEqual(["message 2", "message 3"], [m for m, server in notifier.delivered if server is servers[1]])
+
+    def test_stop(self):
+        servers = []
+        notifier = self.get_notifier(servers)
+        with EmailDispatcher(notifier, pool_size=1) as dispatcher:
+            results = []
+            for key, error in dispatcher.send((i, f"message {i}", ["a@b.edu"]) for i in range(10)):
+                results.append(key)
+                dispatcher.stop()
+        self.assertLess(len(results), 10)
+        self.assertEqual(len(results), len(notifier.delivered))
+
+    def test_rate_limited(self):
+        limiter = RateLimiter(per_second=1000)
+        limiter.acquire = MagicMock()
+        with EmailDispatcher(self.get_notifier([]), rate_limiter=limiter) as dispatcher:
+            list(dispatcher.send((i, f"message {i}", ["a@b.edu"]) for i in range(5)))
+        self.assertEqual(5, limiter.acquire.call_count)
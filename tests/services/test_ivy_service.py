@@ -1,22 +1,35 @@
 import datetime
+import shutil
+import tempfile
+from unittest.mock import patch
 
 import pytz
+from dateutil import parser
 
 from tests.base_test import BaseTest
 import os
 import unittest
 import globus_sdk
+from sqlalchemy import event
 
 from communicator import app, db
 
 from communicator.models.ivy_file import IvyFile
 
 from communicator.errors import CommError
+from communicator.services.copy_import_service import CopyImportService
 from communicator.services.ivy_service import IvyService
 
 
 class IvyServiceTest(BaseTest):
 
+    def setUp(self):
+        self.import_dir = app.config['IVY_IMPORT_DIR']
+
+    def tearDown(self):
+        app.config['IVY_IMPORT_DIR'] = self.import_dir
+        super().tearDown()
+
     def test_read_file_and_build_records(self):
         records = IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file)
         self.assertEqual("987654321", records[0].student_id)
@@ -51,10 +64,174 @@ class IvyServiceTest(BaseTest):
         self.assertEqual(date, records[0].date)
 
 
-    def test_load_directory(self):
+    def test_files_to_import(self):
         self.assertEqual(0, db.session.query(IvyFile).count())
         app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
-        files, _ = IvyService().load_directory()
+        files = IvyService().files_to_import()
+        self.assertEqual(4, len(files))
+
+    def test_read_file_in_chunks(self):
+        chunks = list(IvyService.chunks_from_ivy_file(self.ivy_path, self.ivy_file, 4))
+        self.assertEqual([4, 2], [len(chunk) for chunk in chunks])
+        self.assertEqual("987654321", chunks[0][0].student_id)
+
+    def test_load_local_files_in_chunks(self):
+        from communicator.api import admin
+        from communicator.models import Sample
+        app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
+        app.config['IVY_IMPORT_CHUNK_SIZE'] = 1
+        try:
+            admin.load_local_files()
+        finally:
+            app.config['IVY_IMPORT_CHUNK_SIZE'] = 5000
+        files = db.session.query(IvyFile).order_by(IvyFile.file_name).all()
         self.assertEqual(4, len(files))
+        self.assertEqual([1, 1, 2, 2], [f.sample_count for f in files])
+        self.assertTrue(all(f.date_completed is not None for f in files))
+        self.assertEqual(5, db.session.query(Sample).count())
 
+    def test_parse_files_in_parallel(self):
+        app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
+        service = IvyService()
+        file_names = sorted(service.list_files())
+        results = list(service.parse_files_in_parallel(file_names, 2))
+        self.assertEqual(file_names, [file_name for file_name, _ in results])
+        for file_name, rows in results:
+            expected = IvyService.samples_from_ivy_file(service.path, file_name)
+            samples = [s for chunk in IvyService.chunks_from_rows(rows, file_name, 1) for s in chunk]
+            self.assertEqual([s.barcode for s in expected], [s.barcode for s in samples])
+            self.assertEqual([s.date for s in expected], [s.date for s in samples])
+            self.assertTrue(all(s.ivy_file == file_name and s.in_ivy for s in samples))
+
+    def test_parse_test_date(self):
+        for value in ['202009030809', '202012312359', '2020-09-03 08:09', 'Sep 3 2020 8:09am']:
+            expected = pytz.timezone("America/New_York").localize(parser.parse(value))
+            self.assertEqual(expected, IvyService.parse_test_date(value))
+        with self.assertRaises(Exception):
+            IvyService.parse_test_date('202127190809')
+
+    def test_date_failures_reported_once_per_file(self):
+        ivy_incorrect_path = os.path.join(app.root_path, '..', 'tests', 'data')
+        with patch('communicator.services.ivy_service.sentry_sdk.capture_message') as capture_message:
+            IvyService.samples_from_ivy_file(ivy_incorrect_path, 'incorrect_date.csv')
+        self.assertEqual(1, capture_message.call_count)
+        self.assertIn('incorrect_date.csv', capture_message.call_args[0][0])
+
+    def test_unchanged_files_are_not_imported_again(self):
+        from communicator.api import admin
+        with tempfile.TemporaryDirectory() as import_dir:
+            for file_name in ['file1.csv', 'file3.csv']:
+                shutil.copy(os.path.join(self.ivy_path, 'import_directory', file_name), import_dir)
+            app.config['IVY_IMPORT_DIR'] = import_dir
+            self.assertEqual(2, len(IvyService().files_to_import()))
+            db.session.rollback()
+
+            admin.load_local_files()
+            self.assertEqual([], IvyService().files_to_import())
+
+            # Modified files are imported again.
+            with open(os.path.join(import_dir, 'file1.csv'), 'a') as file:
+                file.write('\n')
+            self.assertEqual(['file1.csv'], [f.file_name for f in IvyService().files_to_import()])
+
+    def test_duplicate_files_are_not_imported(self):
+        from communicator.api import admin
+        with tempfile.TemporaryDirectory() as import_dir:
+            shutil.copy(os.path.join(self.ivy_path, 'import_directory', 'file3.csv'), import_dir)
+            app.config['IVY_IMPORT_DIR'] = import_dir
+            admin.load_local_files()
+
+            shutil.copy(os.path.join(import_dir, 'file3.csv'), os.path.join(import_dir, 'file3_again.csv'))
+            self.assertEqual([], IvyService().files_to_import())
+            db.session.commit()
+            duplicate = db.session.query(IvyFile).filter(IvyFile.file_name == 'file3_again.csv').first()
+            self.assertEqual('file3.csv', duplicate.duplicate_of)
+            self.assertEqual(0, duplicate.sample_count)
+
+    def test_files_are_checked_with_one_query(self):
+        from communicator.api import admin
+        app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
+        admin.load_local_files()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual([], IvyService().files_to_import())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(1, len([s for s in statements if 'FROM ivy_file' in s]))
+
+    def test_identical_new_files_are_imported_once(self):
+        with tempfile.TemporaryDirectory() as import_dir:
+            shutil.copy(os.path.join(self.ivy_path, 'import_directory', 'file3.csv'), import_dir)
+            shutil.copy(os.path.join(import_dir, 'file3.csv'), os.path.join(import_dir, 'file3_again.csv'))
+            app.config['IVY_IMPORT_DIR'] = import_dir
+            self.assertEqual(1, len(IvyService().files_to_import()))
+
+    def check_copy_import_matches_upsert(self, path, file_name):
+        from communicator.models import Sample
+        from communicator.services.sample_service import SampleService
+        columns = lambda s: (s.barcode, s.student_id, s.phone, s.email, s.location, s.result_code, s.date,
+                             s.ivy_file, s.in_ivy, s.email_notified, s.result_received_on is not None,
+                             s.phone_e164, s.phone_valid)
+
+        SampleService().upsert_records(IvyService.samples_from_ivy_file(path, file_name))
+        expected = sorted(columns(s) for s in db.session.query(Sample).all())
+        db.session.query(Sample).delete()
+        db.session.commit()
 
+        counts = CopyImportService().import_file(path, file_name)
+        db.session.commit()
+        self.assertEqual(expected, sorted(columns(s) for s in db.session.query(Sample).all()))
+        return counts, expected
+
+    def test_copy_import_matches_upsert(self):
+        counts, _ = self.check_copy_import_matches_upsert(self.ivy_path, self.ivy_file)
+        self.assertEqual(6, counts.new)
+
+        counts = CopyImportService().import_file(self.ivy_path, self.ivy_file)
+        self.assertEqual((0, 0, 6), (counts.new, counts.changed, counts.unchanged))
+
+    def test_copy_import_merges_duplicates_within_a_file(self):
+        """A barcode that appears twice in one file keeps values the later row leaves blank."""
+        with tempfile.TemporaryDirectory() as import_dir:
+            with open(os.path.join(import_dir, 'duplicates.csv'), 'w') as file:
+                file.write("Student ID|Student Cellphone|Student Email|Test Date Time|Test Kiosk Loc|"
+                           "Test Result Code|Test Bar Code\n"
+                           "987654321|555/555-5555|rkc7h@virginia.edu|202009030809|4321||987654321-RKC-202009030809-4321\n"
+                           "987654322|555/555-5556|tp@virginia.edu|202009060919|4321||987654322-TP-202009060919-4321\n"
+                           "987654321|||202009030810|4322|8726520277|987654321-RKC-202009030809-4321\n")
+            counts, samples = self.check_copy_import_matches_upsert(import_dir, 'duplicates.csv')
+        self.assertEqual(2, len(samples))
+        self.assertEqual((2, 1), (counts.new, counts.duplicates))
+        barcode, student_id, phone, email, location, result_code = samples[0][:6]
+        self.assertEqual(('555/555-5555', 'rkc7h@virginia.edu', '8726520277'), (phone, email, result_code))
+        self.assertEqual(('+15555555555', False), samples[0][-2:])
+
+    def test_hash_file_counts_lines_across_blocks(self):
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv') as file:
+            file.write(b"header\n" + b"x" * (1024 * 1024) + b"\n\n  \nlast")
+            file.flush()
+            file_hash, lines = IvyService.hash_file(file.name)
+        self.assertEqual(3, lines)
+        self.assertEqual(64, len(file_hash))
+
+    def test_large_files_are_copied(self):
+        from communicator.api import admin
+        from communicator.models import Sample
+        app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
+        app.config['IVY_COPY_THRESHOLD_ROWS'] = 1
+        try:
+            with patch('communicator.api.admin.CopyImportService.import_file', wraps=CopyImportService().import_file) \
+                    as import_file, patch.object(IvyService, 'hash_file', wraps=IvyService.hash_file) as hash_file:
+                admin.load_local_files()
+        finally:
+            app.config['IVY_COPY_THRESHOLD_ROWS'] = 50000
+        self.assertEqual(['file3.csv', 'file4.csv'], sorted(c[0][1] for c in import_file.call_args_list))
+        self.assertEqual(4, hash_file.call_count)  # The rows are counted as each file is hashed.
+        self.assertEqual(5, db.session.query(Sample).count())
+        self.assertEqual([1, 1, 2, 2], [f.sample_count for f in
+                                        db.session.query(IvyFile).order_by(IvyFile.file_name).all()])
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from tests.base_test import BaseTest
+
+from communicator.services.ivy_watcher import Debouncer, IvyWatcher
+
+
+class TestIvyWatcher(BaseTest):
+
+    def wait_for(self, event, timeout=5):
+        self.assertTrue(event.wait(timeout), "Timed out waiting for the callback")
+
+    def test_debouncer_collapses_a_burst_into_one_call(self):
+        calls = []
+        called = threading.Event()
+        debouncer = Debouncer(lambda: (calls.append(1), called.set()), delay=0.2)
+        for i in range(10):
+            debouncer.trigger()
+            time.sleep(0.01)
+        self.wait_for(called)
+        time.sleep(0.3)
+        self.assertEqual(1, len(calls))
+
+    def test_debouncer_does_not_wait_forever(self):
+        called = threading.Event()
+        debouncer = Debouncer(called.set, delay=0.2, max_wait=0.3)
+        start = time.monotonic()
+        while not called.is_set() and time.monotonic() - start < 2:
+            debouncer.trigger()
+            time.sleep(0.05)
+        self.assertTrue(called.is_set())
+
+    def check_watcher(self, poll):
+        called = threading.Event()
+        with tempfile.TemporaryDirectory() as import_dir:
+            watcher = IvyWatcher(import_dir, called.set, debounce_seconds=0.1, poll=poll, poll_seconds=0.1)
+            watcher.start()
+            try:
+                time.sleep(0.2)
+                self.assertFalse(called.is_set())
+                with open(os.path.join(import_dir, 'results.csv'), 'w') as file:
+                    file.write("Student ID|Student Cellphone\n")
+                self.wait_for(called)
+            finally:
+                watcher.stop()
+
+    def test_watcher_calls_back_when_a_file_arrives(self):
+        self.check_watcher(poll=False)
+
+    def test_polling_watcher_calls_back_when_a_file_arrives(self):
+        self.check_watcher(poll=True)
+
+    def test_watcher_falls_back_to_polling_without_watchdog(self):
+        with patch('communicator.services.ivy_watcher.Observer', None):
+            self.check_watcher(poll=False)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from tests.base_test import BaseTest
+
+from communicator import db
+from communicator.api import admin
+from communicator.models import Sample
+from communicator.models.notification import EMAIL_TYPE
+from communicator.services.latency_service import LatencyService
+from communicator.services.notification_recorder import NotificationRecorder
+
+
+class TestLatencyService(BaseTest):
+
+    def add_sample(self, barcode, ivy_file, received, waited_minutes=None):
+        sample = Sample(barcode=barcode, ivy_file=ivy_file, result_code='1234', result_received_on=received)
+        if waited_minutes is not None:
+            sample.email_notified_on = received + timedelta(minutes=waited_minutes)
+        db.session.add(sample)
+        return sample
+
+    def test_first_successful_notification_is_recorded(self):
+        sample = Sample(barcode='001', result_code='1234', result_received_on=datetime.now(pytz.utc))
+        db.session.add(sample)
+        db.session.commit()
+        with NotificationRecorder(EMAIL_TYPE) as recorder:
+            recorder.record(sample, error_message="Bounced")
+        db.session.refresh(sample)
+        self.assertIsNone(sample.email_notified_on)
+
+        with NotificationRecorder(EMAIL_TYPE) as recorder:
+            recorder.record(sample)
+        db.session.refresh(sample)
+        first = sample.email_notified_on
+        self.assertIsNotNone(first)
+        self.assertIsNone(sample.text_notified_on)
+
+        with NotificationRecorder(EMAIL_TYPE) as recorder:
+            recorder.record(sample)  # Sent again, by hand, doesn't change how long they waited.
+        db.session.refresh(sample)
+        self.assertEqual(first, sample.email_notified_on)
+
+    def test_waits_by_file_and_day(self):
+        monday = datetime(2020, 10, 5, 14, tzinfo=pytz.utc)
+        tuesday = monday + timedelta(days=1)
+        for i, minutes in enumerate([1, 2, 3, 4, 100]):
+            self.add_sample(f'mon{i}', 'monday.csv', monday, minutes)
+        self.add_sample('mon-waiting', 'monday.csv', monday)
+        self.add_sample('tue0', 'tuesday.csv', tuesday, 10)
+        db.session.commit()
+
+        by_file = {result['ivy_file']: result for result in LatencyService.percentiles(notification_type=EMAIL_TYPE)}
+        self.assertEqual(['monday.csv', 'tuesday.csv'], sorted(by_file))
+        self.assertEqual(5, by_file['monday.csv']['count'])
+        self.assertEqual(180, by_file['monday.csv']['p50'])
+        self.assertGreater(by_file['monday.csv']['p99'], by_file['monday.csv']['p90'])
+        self.assertEqual(600, by_file['tuesday.csv']['p50'])
+
+        by_day = admin.get_notification_latency(group_by='day')
+        self.assertEqual([('2020-10-05', 'email', 5), ('2020-10-06', 'email', 1)],
+                         [(result['day'], result['type'], result['count']) for result in by_day])
@@ -0,0 +1,53 @@
+import smtplib
+from unittest.mock import patch
+
+from tests.base_test import BaseTest
+
+from communicator import db
+from communicator.api import admin
+from communicator.models import Sample
+from communicator.services.metrics import Metrics, metrics
+
+
+class TestMetrics(BaseTest):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_histograms_estimate_percentiles(self):
+        timings = Metrics()
+        for _ in range(98):
+            timings.observe('send_seconds', 0.004)
+        timings.observe('send_seconds', 0.2)
+        timings.observe('send_seconds', 75)
+        timings.increment('sent', 2)
+        timings.increment('sent')
+        histogram = timings.snapshot()['histograms']['send_seconds']
+        self.assertEqual(100, histogram['count'])
+        self.assertEqual(0.005, histogram['p50'])
+        self.assertEqual(0.25, histogram['p99'])
+        self.assertEqual(75, histogram['max'])
+        self.assertEqual(1, histogram['buckets']['+Inf'])
+        self.assertEqual(3, timings.snapshot()['counters']['sent'])
+        self.assertIn('send_seconds', timings.report())
+
+    def test_each_stage_of_sending_emails_is_measured(self):
+        for i in range(4):
+            db.session.add(Sample(barcode=f'00{i}', email=f'student{i}@virginia.edu', result_code='1234'))
+        db.session.add(Sample(barcode='failed', email='failed@virginia.edu', result_code='1234', email_failed=True))
+        db.session.commit()
+        deliver = admin.NotificationService.deliver
+
+        def refuse_one(notifier, message, recipients, email_server=None):
+            if recipients == ['student2@virginia.edu']:
+                raise smtplib.SMTPRecipientsRefused({recipients[0]: (550, b'No such user')})
+            return deliver(notifier, message, recipients, email_server)
+
+        with patch.object(admin.NotificationService, 'deliver', refuse_one):
+            admin._notify_by_email()
+        snapshot = admin.get_metrics()
+        self.assertEqual({'email_sent': 3, 'email_failed{code=550}': 1, 'email_skipped_prior_failure': 1},
+                         snapshot['counters'])
+        for stage in ['query', 'build', 'rate_wait', 'send', 'record']:
+            self.assertGreater(snapshot['histograms'][f'email_{stage}_seconds']['count'], 0, stage)
+        self.assertEqual(4, snapshot['histograms']['email_send_seconds']['count'])
@@ -0,0 +1,63 @@
+import time
+
+from sqlalchemy import event
+
+from tests.base_test import BaseTest
+
+from communicator import db
+from communicator.models import Sample
+from communicator.models.notification import Notification, EMAIL_TYPE, TEXT_TYPE
+from communicator.services.notification_recorder import NotificationRecorder
+
+
+class TestNotificationRecorder(BaseTest):
+
+    def add_samples(self, count):
+        samples = [Sample(barcode=str(i), result_code="1234") for i in range(count)]
+        db.session.add_all(samples)
+        db.session.commit()
+        return samples
+
+    def count_inserts(self):
+        inserts = []
+        listener = lambda conn, cursor, statement, *args: \
+            inserts.append(statement) if statement.startswith('INSERT INTO notification') else None
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', listener)
+        return inserts
+
+    def test_outcomes_are_written_in_batches(self):
+        samples = self.add_samples(25)
+        inserts = self.count_inserts()
+        with NotificationRecorder(EMAIL_TYPE, batch_size=10, max_seconds=0) as recorder:
+            for sample in samples[:20]:
+                recorder.record(sample)
+            self.assertEqual(20, db.session.query(Notification).count())
+            for sample in samples[20:]:
+                recorder.record(sample, error_message="Bounced")
+            self.assertEqual(20, db.session.query(Notification).count())
+        self.assertEqual(3, len(inserts))
+        self.assertEqual(25, db.session.query(Notification).count())
+        self.assertEqual(20, db.session.query(Sample).filter(Sample.email_notified == True).count())
+        self.assertEqual(5, db.session.query(Sample).filter(Sample.email_failed == True).count())
+        self.assertFalse(samples[0].text_notified)
+        self.assertTrue(samples[0].email_notified)  # The session sees the changes once we are done.
+
+    def test_outcomes_are_written_after_a_while(self):
+        samples = self.add_samples(2)
+        with NotificationRecorder(TEXT_TYPE, batch_size=100, max_seconds=0.05) as recorder:
+            recorder.record(samples[0])
+            time.sleep(0.5)
+            self.assertEqual(1, db.session.query(Notification).count())
+            recorder.record(samples[1])
+        self.assertEqual(2, db.session.query(Sample).filter(Sample.text_notified == True).count())
+
+    def test_outcomes_are_written_on_an_error(self):
+        samples = self.add_samples(3)
+        with self.assertRaises(ValueError):
+            with NotificationRecorder(EMAIL_TYPE, batch_size=100, max_seconds=0) as recorder:
+                recorder.record(samples[0], error_message="Bounced")
+                recorder.record(samples[0])
+                raise ValueError("Something went wrong")
+        self.assertEqual(2, db.session.query(Notification).count())
+        self.assertEqual((True, False), (samples[0].email_notified, samples[0].email_failed))
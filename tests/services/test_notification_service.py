@@ -1,12 +1,15 @@
+import smtplib
 from datetime import datetime
+from unittest.mock import MagicMock, patch
 
 import pytz
 
 from tests.base_test import BaseTest
 
 
-from communicator import app
-from communicator.models import Sample
+from communicator import app, db
+from communicator.models import Sample, Invitation
+from communicator.models.invitation_batch import SENT, FAILED
 from communicator.services.notification_service import TEST_MESSAGES, NotificationService
 
 
@@ -41,3 +44,74 @@ class TestNotificationService(BaseTest):
                          "please visit: https://besafe.virginia.edu/result-demo?code=1234. "
                          "Reply 'STOP' to opt-out.",
                          TEST_MESSAGES[-1])
+
+    def test_result_emails_are_built_from_a_skeleton(self):
+        with NotificationService(app) as notifier:
+            first = notifier.build_result_email(Sample(email="a@virginia.edu", result_code="1234"))
+            second = notifier.build_result_email(Sample(email="b@virginia.edu", result_code="5678&x"))
+        self.assertEqual("a@virginia.edu", first['To'])
+        self.assertEqual("UVA: BE SAFE Notification", self.decode(second['subject']))
+        text, html = [part.get_payload(decode=True).decode() for part in second.get_payload()[0].get_payload()]
+        self.assertIn("https://besafe.virginia.edu/result-demo?code=5678&x", text)
+        self.assertIn('href="https://besafe.virginia.edu/result-demo?code=5678&amp;x"', html)
+        self.assertNotIn('@@', text + html)
+        # The logo is only read, and encoded, once.
+        self.assertIs(first.get_payload()[1], second.get_payload()[1])
+
+    def test_emails_go_over_the_wire_with_crlf_line_endings(self):
+        server = MagicMock()
+        with NotificationService(app) as notifier:
+            message = notifier.build_result_email(Sample(email="a@virginia.edu", result_code="1234"))
+            app.config['TESTING'] = False
+            try:
+                notifier.deliver(message, ["a@virginia.edu"], server)
+            finally:
+                app.config['TESTING'] = True
+        data = server.sendmail.call_args[0][2]
+        self.assertNotIn(b'\n', data.replace(b'\r\n', b''))
+        self.assertEqual(message.as_bytes().count(b'\n'), data.count(b'\r\n'))
+
+    def test_texts_wait_for_a_reasonable_hour(self):
+        eastern = pytz.timezone('US/Eastern')
+
+        def at(day, hour, minute=0):
+            return eastern.localize(datetime(2020, 10, day, hour, minute))
+        self.assertIsNone(NotificationService.text_window_opens(at(10, 8)))
+        self.assertIsNone(NotificationService.text_window_opens(at(10, 21, 59)))
+        self.assertEqual(at(10, 8), NotificationService.text_window_opens(at(10, 2)))
+        self.assertEqual(at(10, 8), NotificationService.text_window_opens(at(10, 2).astimezone(pytz.utc)))
+        self.assertEqual(at(11, 8), NotificationService.text_window_opens(at(10, 23)))
+        self.assertFalse(NotificationService(app).is_reasonable_hour_for_text_messages(at(10, 23)))
+        self.assertTrue(NotificationService(app).is_reasonable_hour_for_text_messages(at(10, 12)))
+
+    def test_invitations_are_sent_in_batches(self):
+        app.config['MAIL_MAX_RECIPIENTS'] = 2
+        sent = []
+        failures = [smtplib.SMTPRecipientsRefused({'c@virginia.edu': (552, b'Too many recipients')})]
+
+        def deliver(notifier, message, recipients, email_server=None):
+            if 'c@virginia.edu' in recipients and failures:
+                raise failures.pop()
+            sent.append(sorted(recipients))
+
+        try:
+            with patch('communicator.services.notification_service.render_template', lambda name, **kw: name), \
+                    patch.object(NotificationService, 'deliver', deliver):
+                with NotificationService(app) as notifier:
+                    invitation = notifier.send_invitations("10/10/2020", "Gym", "a@virginia.edu\n\nb@virginia.edu\n"
+                                                           "c@virginia.edu\nd@virginia.edu\ne@virginia.edu \n")
+                    self.assertEqual(5, invitation.total_recipients)
+                    self.assertEqual([SENT, FAILED, SENT], [batch.status for batch in invitation.batches])
+                    self.assertIn('Too many recipients', invitation.batches[1].error_message)
+                    self.assertEqual([[app.config['MAIL_SENDER'], 'a@virginia.edu', 'b@virginia.edu'], ['e@virginia.edu']],
+                                     sorted(sent))
+
+                    notifier.send_invitation_batches(invitation)  # Just the batch that failed.
+                    self.assertEqual(['c@virginia.edu', 'd@virginia.edu'], sent[-1])
+                    self.assertEqual(3, len(sent))
+                    self.assertEqual([SENT, SENT, SENT], [batch.status for batch in invitation.batches])
+                    self.assertEqual([1, 2, 1], [batch.attempts for batch in invitation.batches])
+        finally:
+            app.config['MAIL_MAX_RECIPIENTS'] = 100
+            db.session.query(Invitation).delete()
+            db.session.commit()
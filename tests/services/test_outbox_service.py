@@ -0,0 +1,160 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from sqlalchemy import select
+
+from tests.base_test import BaseTest
+
+from communicator import app, db
+from communicator.api import admin
+from communicator.models import Sample, NotificationOutbox
+from communicator.models.notification import Notification, EMAIL_TYPE, TEXT_TYPE
+from communicator.services.metrics import metrics
+from communicator.services.notification_service import TEST_MESSAGES, NotificationService
+from communicator.services.outbox_service import OutboxService
+
+
+class TestOutboxService(BaseTest):
+
+    def setUp(self):
+        self.import_dir = app.config['IVY_IMPORT_DIR']
+        app.config['NOTIFICATION_OUTBOX'] = True
+
+    def tearDown(self):
+        app.config['IVY_IMPORT_DIR'] = self.import_dir
+        app.config['NOTIFICATION_OUTBOX'] = False
+        super().tearDown()
+
+    def add_samples(self, count):
+        for i in range(count):
+            db.session.add(Sample(barcode=f'{i:03}', email=f'student{i}@virginia.edu', result_code='1234',
+                                  phone='540-457-0024', phone_e164='+15404570024', phone_valid=True))
+        db.session.add(Sample(barcode='no_result', email='student@virginia.edu'))
+        db.session.commit()
+
+    def test_enqueue_adds_waiting_samples_once(self):
+        self.add_samples(3)
+        self.assertEqual(3, OutboxService.enqueue(EMAIL_TYPE))
+        self.assertEqual(3, OutboxService.enqueue(TEXT_TYPE))
+        self.assertEqual(0, OutboxService.enqueue(EMAIL_TYPE))
+        db.session.commit()
+        self.assertEqual(6, db.session.query(NotificationOutbox).count())
+
+    def test_results_are_added_to_the_outbox_as_they_are_loaded(self):
+        app.config['IVY_IMPORT_DIR'] = os.path.join(app.root_path, '..', 'tests', 'data', 'import_directory')
+        admin.load_local_files()
+        self.assertEqual(db.session.query(Sample).count(),
+                         db.session.query(NotificationOutbox).filter(NotificationOutbox.type == EMAIL_TYPE).count())
+
+    def test_workers_lease_different_samples(self):
+        self.add_samples(10)
+        OutboxService.enqueue(EMAIL_TYPE)
+        db.session.commit()
+
+        # Another worker, part way through leasing the first three.
+        outbox = NotificationOutbox.__table__
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(select([outbox.c.id]).order_by(outbox.c.id).limit(3).with_for_update())
+        try:
+            first = OutboxService(EMAIL_TYPE, lease_size=4).lease()
+            second = OutboxService(EMAIL_TYPE, lease_size=4).lease()
+        finally:
+            transaction.rollback()
+            connection.close()
+        self.assertEqual(['003', '004', '005', '006'], sorted(s.barcode for s in first))
+        self.assertEqual(['007', '008', '009'], sorted(s.barcode for s in second))
+
+    def test_leases_run_out_or_can_be_released(self):
+        self.add_samples(2)
+        OutboxService.enqueue(EMAIL_TYPE)
+        db.session.commit()
+        worker = OutboxService(EMAIL_TYPE, lease_seconds=0.001)
+        self.assertEqual(2, len(worker.lease()))
+        self.assertEqual(2, len(OutboxService(EMAIL_TYPE).lease()))  # The first lease ran out.
+
+        worker = OutboxService(EMAIL_TYPE)
+        db.session.query(NotificationOutbox).update({NotificationOutbox.leased_until: None})
+        db.session.commit()
+        self.assertEqual(2, len(worker.lease()))
+        self.assertEqual([], OutboxService(EMAIL_TYPE).lease())
+        worker.release()
+        self.assertEqual(2, len(OutboxService(EMAIL_TYPE).lease()))
+
+    def test_gives_up_on_samples_that_never_get_an_outcome(self):
+        self.add_samples(2)
+        OutboxService.enqueue(EMAIL_TYPE)
+        db.session.commit()
+        worker = OutboxService(EMAIL_TYPE, max_attempts=3)
+        worker.lease()
+        worker.release()  # Didn't get to them, doesn't count.
+        for _ in range(3):
+            self.assertEqual(2, len(OutboxService(EMAIL_TYPE, lease_seconds=0.001, max_attempts=3).lease()))
+
+        # The third notifier to lease them died before sending them too.
+        self.assertEqual([], OutboxService(EMAIL_TYPE, max_attempts=3).lease())
+        self.assertEqual(0, db.session.query(NotificationOutbox).count())
+        failures = db.session.query(Notification).filter(Notification.successful == False).all()
+        self.assertEqual(['000', '001'], sorted(n.sample_barcode for n in failures))
+        self.assertEqual(2, db.session.query(Sample).filter(Sample.email_failed == True).count())
+
+        # They can be tried again, as any other failure.
+        OutboxService.enqueue(EMAIL_TYPE, retry=True)
+        self.assertEqual(2, len(OutboxService(EMAIL_TYPE, max_attempts=3).lease()))
+
+    def test_concurrent_notifiers_do_not_send_twice(self):
+        self.add_samples(30)
+        app.config['NOTIFICATION_LEASE_SIZE'] = 4
+        message_count = len(TEST_MESSAGES)
+        errors = []
+
+        def notify():
+            with app.app_context():
+                try:
+                    admin._notify_by_email()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        workers = [threading.Thread(target=notify) for _ in range(3)]
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            app.config['NOTIFICATION_LEASE_SIZE'] = 100
+        self.assertEqual([], errors)
+        sent = [message['To'] for message in TEST_MESSAGES[message_count:]]
+        self.assertEqual(30, len(sent))
+        self.assertEqual(30, len(set(sent)))
+        self.assertEqual(30, db.session.query(Notification).count())
+        self.assertEqual(0, db.session.query(NotificationOutbox).count())
+
+    def test_texts_wait_in_the_outbox_for_a_reasonable_hour(self):
+        self.add_samples(3)
+        message_count = len(TEST_MESSAGES)
+        morning = datetime.now(pytz.utc) + timedelta(hours=6)
+        with patch.object(NotificationService, 'text_window_opens', return_value=morning):
+            admin._notify_by_text()
+        self.assertEqual(message_count, len(TEST_MESSAGES))
+        self.assertEqual((3, morning), tuple(OutboxService.depth(TEXT_TYPE)))
+        self.assertEqual(3, metrics.get('text_queue_depth'))
+        self.assertEqual([], OutboxService(TEXT_TYPE).lease())  # Not yet.
+
+        # The morning comes.
+        db.session.query(NotificationOutbox).update({NotificationOutbox.not_before: datetime.now(pytz.utc)})
+        db.session.commit()
+        with patch.object(NotificationService, 'text_window_opens', return_value=None):
+            admin._notify_by_text()
+        self.assertEqual(message_count + 3, len(TEST_MESSAGES))
+        self.assertEqual(3, metrics.get('text_drain_sent'))
+        queue = admin.get_text_queue()
+        self.assertEqual(0, queue['depth'])
+        self.assertIsNone(queue['not_before'])
+        self.assertEqual(3, queue['last_drain_sent'])
@@ -0,0 +1,119 @@
+import smtplib
+from unittest.mock import patch
+
+from tests.base_test import BaseTest
+from tests.fakes import FakeClock
+
+from communicator import app, db
+from communicator.api import admin
+from communicator.models import Sample, RateLimitState
+from communicator.models.notification import Notification
+from communicator.services.notification_service import TEST_MESSAGES
+from communicator.services.rate_controller import AdaptiveRateController
+
+
+class TestAdaptiveRateController(BaseTest):
+
+    def get_controller(self, clock, **kwargs):
+        return AdaptiveRateController('test', clock=clock.time, sleep=clock.sleep, **kwargs)
+
+    def test_throttling_halves_the_rate_and_backs_off(self):
+        clock = FakeClock()
+        controller = self.get_controller(clock, max_rate=10, backoff_seconds=30)
+        self.assertEqual(30, controller.on_throttle())
+        self.assertEqual(5, controller.rate)
+        self.assertIsNone(controller.on_throttle())  # Already backing off, not counted again.
+        self.assertEqual(5, controller.rate)
+        controller.acquire()
+        self.assertEqual(30, clock.now)
+
+        # Throttled again soon after, backs off for longer.
+        self.assertEqual(60, controller.on_throttle())
+        self.assertEqual(2.5, controller.rate)
+
+    def test_sustained_success_raises_the_rate(self):
+        clock = FakeClock()
+        controller = self.get_controller(clock, max_rate=10, increase_after=10)
+        controller.on_throttle()
+        for _ in range(10):
+            controller.acquire()
+            controller.on_success()
+        self.assertAlmostEqual(5.5, controller.rate)
+        for _ in range(1000):
+            controller.acquire()
+            controller.on_success()
+        self.assertEqual(10, controller.rate)
+
+    def test_state_is_shared(self):
+        clock = FakeClock()
+        clock.now = 1000
+        self.get_controller(clock, max_rate=10).on_throttle()
+        state = db.session.query(RateLimitState).filter(RateLimitState.name == 'test').first()
+        self.assertEqual(5, state.rate)
+
+        other = self.get_controller(clock, max_rate=10)
+        self.assertEqual(5, other.rate)
+        other.acquire()
+        self.assertEqual(1030, clock.now)
+
+    def test_unlimited_slows_to_half_the_observed_rate(self):
+        clock = FakeClock()
+        controller = self.get_controller(clock)
+        for _ in range(40):
+            clock.now += 0.25
+            controller.acquire()
+            controller.on_success()
+        controller.on_throttle()
+        self.assertEqual(2, controller.rate)
+
+    def test_notify_by_email_resumes_after_a_throttle(self):
+        for i in range(3):
+            db.session.add(Sample(barcode=f"00000011{i}-202009091449-4321", location="4321",
+                                  date="2020-09-09T14:49:00+0000", student_id=f"00000011{i}",
+                                  email="daniel.h.funk@gmail.com", result_code="12345", ivy_file="xxx"))
+        db.session.commit()
+        message_count = len(TEST_MESSAGES)
+        deliver = admin.NotificationService.deliver
+        failures = [smtplib.SMTPResponseException(451, b"Too many messages")]
+
+        def flaky_deliver(notifier, message, recipients, email_server=None):
+            if failures:
+                raise failures.pop()
+            return deliver(notifier, message, recipients, email_server)
+
+        app.config['MAIL_BACKOFF_SECONDS'] = 0.1
+        try:
+            with patch.object(admin.NotificationService, 'deliver', flaky_deliver):
+                admin._notify_by_email()
+        finally:
+            app.config['MAIL_BACKOFF_SECONDS'] = 30
+        self.assertEqual(3, db.session.query(Sample).filter(Sample.email_notified == True).count())
+        self.assertEqual(message_count + 3, len(TEST_MESSAGES))
+        state = db.session.query(RateLimitState).filter(RateLimitState.name == 'smtp').first()
+        self.assertEqual(1, state.throttle_count)
+
+    def test_saving_the_rate_leaves_the_samples_being_sent_alone(self):
+        for i in range(10):
+            db.session.add(Sample(barcode=f"00{i}", email=f"student{i}@virginia.edu", result_code="12345"))
+        db.session.commit()
+        deliver = admin.NotificationService.deliver
+        attempts = []
+
+        def throttle_third(notifier, message, recipients, email_server=None):
+            attempts.append(recipients)
+            if len(attempts) == 3:  # The last of the first page, while the next is being read.
+                raise smtplib.SMTPResponseException(451, b"Too many messages")
+            return deliver(notifier, message, recipients, email_server)
+
+        config = {'NOTIFICATION_PAGE_SIZE': 3, 'MAIL_POOL_SIZE': 2, 'MAIL_RATE_PER_SECOND': 1000,
+                  'MAIL_RATE_INCREASE_AFTER': 1, 'MAIL_BACKOFF_SECONDS': 0.01}
+        saved = {key: app.config[key] for key in config}
+        app.config.update(config)
+        try:
+            with patch.object(admin.NotificationService, 'deliver', throttle_third):
+                admin._notify_by_email()
+        finally:
+            app.config.update(saved)
+        self.assertEqual(11, len(attempts))
+        self.assertEqual(10, db.session.query(Sample).filter(Sample.email_notified == True).count())
+        self.assertEqual(10, db.session.query(Notification).filter(Notification.successful == True).count())
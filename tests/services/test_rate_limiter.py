@@ -0,0 +1,33 @@
+from tests.base_test import BaseTest
+from tests.fakes import FakeClock
+
+from communicator.services.rate_limiter import RateLimiter
+
+
+class TestRateLimiter(BaseTest):
+
+    def send(self, limiter, clock, count):
+        """Returns the times at which 'count' messages were allowed out."""
+        times = []
+        for _ in range(count):
+            limiter.acquire()
+            times.append(clock.now)
+        return times
+
+    def test_per_second_limit(self):
+        clock = FakeClock()
+        limiter = RateLimiter(per_second=2, clock=clock.time, sleep=clock.sleep)
+        times = self.send(limiter, clock, 6)
+        self.assertEqual([0, 0, 0.5, 1.0, 1.5, 2.0], [round(t, 3) for t in times])
+
+    def test_per_hour_limit(self):
+        clock = FakeClock()
+        limiter = RateLimiter(per_second=10, per_hour=20, clock=clock.time, sleep=clock.sleep)
+        times = self.send(limiter, clock, 21)
+        self.assertLess(times[19], 2)  # The hourly budget can go out as fast as the per second limit allows
+        self.assertAlmostEqual(180, times[20], places=3)  # then one more every 3 minutes.
+
+    def test_no_limit(self):
+        clock = FakeClock()
+        limiter = RateLimiter(per_second=0, per_hour=None, clock=clock.time, sleep=clock.sleep)
+        self.assertEqual([0] * 100, self.send(limiter, clock, 100))
@@ -4,10 +4,12 @@ from time import sleep
 from tests.base_test import BaseTest
 
 import json
+from sqlalchemy import event
 from communicator.models import Sample
 from communicator import db, app
 from communicator.api import admin
-from communicator.models.notification import Notification
+from communicator.models.notification import Notification, EMAIL_TYPE
+from communicator.services.notification_recorder import NotificationRecorder
 
 
 class TestSampleEndpoint(BaseTest):
@@ -43,6 +45,16 @@ class TestSampleEndpoint(BaseTest):
         self.assertEqual(1, samples[0].location)
         self.assertEqual(2, samples[0].station)
 
+    def test_create_sample_normalizes_the_phone_number(self):
+        rv = self.app.post('/v1.0/sample',
+                           content_type="application/json",
+                           data=json.dumps(dict(self.sample_json, phone="(540) 457-0024")))
+
+        sample = db.session.query(Sample).first()
+        self.assertEqual("(540) 457-0024", sample.phone)
+        self.assertEqual("+15404570024", sample.phone_e164)
+        self.assertTrue(sample.phone_valid)
+
     def test_create_sample_has_last_updated(self):
         rv = self.app.post('/v1.0/sample',
                            content_type="application/json",
@@ -90,6 +102,34 @@ class TestSampleEndpoint(BaseTest):
         samples = db.session.query(Sample).filter(Sample.email_notified == True).all()
         self.assertEqual(2, len(samples))
 
+    def test_notify_by_email_skips_failures_in_the_query(self):
+        """Samples whose last attempt failed are left out by the query, without loading any of their
+        notifications, unless we are retrying."""
+        samples = [Sample(barcode=f"00000011{i}-202009091449-4321", email="dan@gmail.com", result_code="12345")
+                   for i in range(5)]
+        db.session.add_all(samples)
+        db.session.commit()
+        with NotificationRecorder(EMAIL_TYPE) as recorder:
+            for i, sample in enumerate(samples):
+                recorder.record(sample, error_message="nope")
+                if i < 2:
+                    recorder.record(sample)
+        db.session.query(Sample).update({Sample.email_notified: False})  # New results came in.
+        db.session.commit()
+        statements = []
+        count = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            admin._notify_by_email()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(2, db.session.query(Sample).filter(Sample.email_notified == True).count())
+        self.assertEqual([], [s for s in statements if s.lstrip().startswith('SELECT') and 'FROM notification' in s])
+
+        admin._notify_by_email(retry=True)
+        self.assertEqual(5, db.session.query(Sample).filter(Sample.email_notified == True).count())
+        self.assertEqual(0, db.session.query(Sample).filter(Sample.email_failed == True).count())
+
     def test_get_all_samples(self):
         s1 = Sample(barcode="000000111-202009091449-4321",
                     location="4321",
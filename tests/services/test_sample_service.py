@@ -1,10 +1,12 @@
 from tests.base_test import BaseTest
 import json
+from datetime import datetime, timedelta
 
 from dateutil import parser
 
 from communicator import db
-from communicator.models.sample import Sample
+from communicator.models.notification import EMAIL_TYPE
+from communicator.models.sample import Sample, normalize_phone
 from communicator.services.ivy_service import IvyService
 from communicator.services.sample_service import SampleService
 
@@ -66,3 +68,120 @@ class IvyServiceTest(BaseTest):
                                  .filter(Sample.in_ivy == True).all()))
         self.assertEqual(7, len(db.session.query(Sample).all()))
 
+    def test_upsert_matches_merge(self):
+        """The set based upsert and the row by row merge should produce identical records."""
+        service = SampleService()
+        ivy_samples = IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file)
+        service.merge_records(self.get_firebase_records())
+        service.merge_records(ivy_samples)
+        merged = {s.barcode: (s.email, s.phone, s.result_code, s.in_firebase, s.in_ivy, s.student_id)
+                  for s in db.session.query(Sample).all()}
+        db.session.query(Sample).delete()
+        db.session.commit()
+
+        ivy_samples = IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file)
+        service.upsert_records(self.get_firebase_records())
+        service.upsert_records(ivy_samples)
+        upserted = {s.barcode: (s.email, s.phone, s.result_code, s.in_firebase, s.in_ivy, s.student_id)
+                    for s in db.session.query(Sample).all()}
+        self.assertEqual(merged, upserted)
+
+    def test_upsert_keeps_existing_values(self):
+        """Missing values in a new record should not wipe out values we already have."""
+        service = SampleService()
+        service.upsert_records([Sample(barcode="123", student_id=123, email="a@virginia.edu", phone="5555555555",
+                                       date=parser.parse("2020-09-09T14:49:00"))])
+        service.upsert_records([Sample(barcode="123", student_id=123, email="", result_code="1234",
+                                       date=parser.parse("2020-09-09T14:49:00"), in_ivy=True)])
+        sample = db.session.query(Sample).filter(Sample.barcode == "123").first()
+        self.assertEqual("a@virginia.edu", sample.email)
+        self.assertEqual("5555555555", sample.phone)
+        self.assertEqual("1234", sample.result_code)
+        self.assertTrue(sample.in_ivy)
+
+    def test_phone_numbers_are_normalized_as_they_are_loaded(self):
+        service = SampleService()
+        barcode = "987654321-RKC-202009030809-4321"
+        for load in (service.merge_records, service.upsert_records):
+            load(IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file))
+            sample = db.session.query(Sample).filter(Sample.barcode == barcode).first()
+            self.assertEqual(("+15555555555", False), (sample.phone_e164, sample.phone_valid))
+
+            # A new number replaces the normalized one, a missing one leaves it be.
+            phone_e164, phone_valid = normalize_phone("540.457.0024")
+            load([Sample(barcode=barcode, phone="540.457.0024", phone_e164=phone_e164, phone_valid=phone_valid)])
+            load([Sample(barcode=barcode, email="rkc7h@virginia.edu")])
+            db.session.refresh(sample)
+            self.assertEqual(("540.457.0024", "+15404570024", True),
+                             (sample.phone, sample.phone_e164, sample.phone_valid))
+            db.session.query(Sample).delete()
+            db.session.commit()
+
+    def test_upsert_duplicate_barcodes_in_one_batch(self):
+        service = SampleService()
+        service.upsert_records([Sample(barcode="123", student_id=123, email="a@virginia.edu",
+                                       date=parser.parse("2020-09-09T14:49:00")),
+                                Sample(barcode="123", student_id=123, result_code="1234",
+                                       date=parser.parse("2020-09-09T14:49:00"))])
+        samples = db.session.query(Sample).all()
+        self.assertEqual(1, len(samples))
+        self.assertEqual("a@virginia.edu", samples[0].email)
+        self.assertEqual("1234", samples[0].result_code)
+
+    def test_unchanged_samples_are_not_written(self):
+        """Loading the same records again should not touch them, or bump their last_modified date."""
+        service = SampleService()
+        counts = service.add_or_update_records(IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file))
+        self.assertEqual((6, 0, 0), (counts.new, counts.changed, counts.unchanged))
+        modified = {s.barcode: s.last_modified for s in db.session.query(Sample).all()}
+
+        counts = service.add_or_update_records(IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file))
+        self.assertEqual((0, 0, 6), (counts.new, counts.changed, counts.unchanged))
+        self.assertEqual(modified, {s.barcode: s.last_modified for s in db.session.query(Sample).all()})
+
+        counts = service.add_or_update_records(self.get_firebase_records())
+        self.assertEqual((1, 3, 0), (counts.new, counts.changed, counts.unchanged))
+
+    def test_merge_records_counts_changes(self):
+        service = SampleService()
+        service.merge_records(IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file))
+        counts = service.merge_records(IvyService.samples_from_ivy_file(self.ivy_path, self.ivy_file))
+        self.assertEqual((0, 0, 6), (counts.new, counts.changed, counts.unchanged))
+        counts = service.merge_records(self.get_firebase_records())
+        self.assertEqual((1, 3, 0), (counts.new, counts.changed, counts.unchanged))
+
+    def test_merge_and_upsert_count_duplicates_the_same_way(self):
+        """A barcode repeated within a batch is counted as a duplicate, whichever path loads it."""
+        service = SampleService()
+        results = {}
+        for load in (service.merge_records, service.upsert_records):
+            load([Sample(barcode="123", student_id=123, email="a@virginia.edu",
+                         date=parser.parse("2020-09-09T14:49:00"))])
+            counts = load([Sample(barcode="123", student_id=123, date=parser.parse("2020-09-09T14:49:00")),
+                           Sample(barcode="123", student_id=123, result_code="1234",
+                                  date=parser.parse("2020-09-09T14:49:00")),
+                           Sample(barcode="456", student_id=456, date=parser.parse("2020-09-09T14:49:00"))])
+            results[load.__name__] = (counts.new, counts.changed, counts.unchanged, counts.duplicates)
+            db.session.query(Sample).delete()
+            db.session.commit()
+        self.assertEqual({'merge_records': (1, 1, 0, 1), 'upsert_records': (1, 1, 0, 1)}, results)
+
+    def test_samples_waiting_for_notification_are_read_a_page_at_a_time(self):
+        created_on = datetime(2020, 10, 1)
+        for i in range(7):
+            db.session.add(Sample(barcode=f'{i:03}', email=f'student{i}@virginia.edu', result_code='1234',
+                                  created_on=created_on + timedelta(hours=i % 3)))
+        db.session.add(Sample(barcode='no_result', email='student@virginia.edu'))
+        db.session.commit()
+
+        pages = []
+        for page in SampleService().waiting_for_notification(EMAIL_TYPE, page_size=3):
+            pages.append([sample.barcode for sample in page])
+            # Notifying the samples as we go doesn't cause any to be skipped.
+            db.session.query(Sample).filter(Sample.barcode.in_(pages[-1])).update(
+                {Sample.email_notified: True}, synchronize_session=False)
+            self.assertTrue(all(sample in db.session for sample in page))
+            previous = page
+        self.assertEqual([['000', '003', '006'], ['001', '004', '002'], ['005']], pages)
+        self.assertFalse(any(sample in db.session for sample in previous))
+        self.assertEqual(0, len(db.session.identity_map))
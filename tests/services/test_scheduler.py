@@ -0,0 +1,36 @@
+import threading
+from unittest.mock import patch
+
+from tests.base_test import BaseTest
+
+from communicator import scheduler
+from communicator.api import admin
+
+
+class TestScheduler(BaseTest):
+
+    def test_files_load_while_emails_are_being_sent(self):
+        sending = threading.Event()
+        finish = threading.Event()
+        runs = []
+
+        def slow_notify():
+            runs.append(1)
+            sending.set()
+            finish.wait(5)
+
+        with patch.object(admin, '_notify_by_email', slow_notify), \
+                patch.object(admin, 'load_local_files') as load_local_files:
+            first = threading.Thread(target=scheduler.notify)
+            first.start()
+            try:
+                self.assertTrue(sending.wait(5))
+                scheduler.notify()  # Skipped, the first run is still going.
+                scheduler.load_files()
+                self.assertEqual(1, load_local_files.call_count)
+                self.assertEqual(1, len(runs))
+            finally:
+                finish.set()
+                first.join()
+            scheduler.notify()
+        self.assertEqual(2, len(runs))
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from aiohttp import web
+
+from tests.base_test import BaseTest
+
+from communicator import app, db
+from communicator.api import admin
+from communicator.errors import CommError
+from communicator.models import Sample
+from communicator.models.notification import Notification, TEXT_TYPE
+from communicator.services.notification_service import NotificationService
+from communicator.services.sms_dispatcher import SmsDispatcher
+
+
+class StubTwilio(object):
+    """A local stand in for Twilio's REST API, answering each request with the next of 'statuses'
+    (201 once they run out), after 'delay' seconds."""
+
+    def __init__(self, statuses=(), delay=0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def handle(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        self.requests.append((request.match_info['sid'], request.headers.get('Authorization'),
+                              dict(await request.post())))
+        status = self.statuses.pop(0) if self.statuses else 201
+        return web.json_response({'code': 21211, 'message': 'Invalid number'} if status >= 400 else {},
+                                 status=status, headers={'Retry-After': '0'})
+
+    def __enter__(self):
+        web_app = web.Application()
+        web_app.router.add_post('/2010-04-01/Accounts/{sid}/Messages.json', self.handle)
+        self.runner = web.AppRunner(web_app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.url = 'http://127.0.0.1:%i' % site._server.sockets[0].getsockname()[1]
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class TestSmsDispatcher(BaseTest):
+
+    def messages(self, count):
+        return [(i, '+15404570024', f"message {i}") for i in range(count)]
+
+    def test_sends_through_the_rest_api(self):
+        with StubTwilio(delay=0.05) as twilio:
+            dispatcher = SmsDispatcher(app, concurrency=4, rate_per_second=0, api_url=twilio.url)
+            results = dict(dispatcher.send(self.messages(20)))
+        self.assertEqual(list(range(20)), sorted(results))
+        self.assertTrue(all(error is None for error in results.values()))
+        self.assertEqual(20, len(twilio.requests))
+        self.assertEqual(4, twilio.max_in_flight)
+        sid, auth, form = twilio.requests[0]
+        self.assertEqual(app.config['TWILIO_SID'], sid)
+        self.assertTrue(auth.startswith('Basic '))
+        self.assertEqual('+15404570024', form['To'])
+        self.assertEqual(app.config['TWILIO_NUMBER'], form['From'])
+
+    def test_respects_the_rate_limit(self):
+        with StubTwilio() as twilio:
+            dispatcher = SmsDispatcher(app, concurrency=8, rate_per_second=5, api_url=twilio.url)
+            start = time.monotonic()
+            list(dispatcher.send(self.messages(8)))
+        # A second's worth go at once, the other three at 5 a second.
+        self.assertGreaterEqual(time.monotonic() - start, 0.55)
+
+    def test_retries_when_throttled_and_reports_failures(self):
+        with StubTwilio(statuses=[429, 400]) as twilio:
+            dispatcher = SmsDispatcher(app, concurrency=1, rate_per_second=0, api_url=twilio.url)
+            results = dict(dispatcher.send(self.messages(2)))
+        self.assertIsInstance(results[0], CommError)
+        self.assertIn('Invalid number', results[0].detail)
+        self.assertIsNone(results[1])
+        self.assertEqual(3, len(twilio.requests))
+
+    def test_notify_by_text_records_results(self):
+        db.session.add(Sample(barcode='1', phone='540-457-0024', phone_e164='+15404570024', phone_valid=True,
+                              result_code='1234'))
+        db.session.add(Sample(barcode='2', phone='540-457-0025', phone_e164='+15404570025', phone_valid=True,
+                              result_code='5678'))
+        db.session.add(Sample(barcode='3', phone='555', phone_valid=False, result_code='9012'))
+        db.session.add(Sample(barcode='4', phone='540-457-0026', phone_e164='+15404570026', phone_valid=True))
+        db.session.commit()
+        with StubTwilio(statuses=[201, 400]) as twilio:
+            with patch('communicator.api.admin.SmsDispatcher',
+                       lambda app: SmsDispatcher(app, concurrency=1, api_url=twilio.url)), \
+                    patch.object(NotificationService, 'text_window_opens', return_value=None):
+                admin._notify_by_text()
+        self.assertEqual(['+15404570024', '+15404570025'], [form['To'] for sid, auth, form in twilio.requests])
+        notifications = {n.sample_barcode: n for n in db.session.query(Notification)}
+        self.assertEqual({'1', '2'}, set(notifications))  # Invalid numbers are skipped.
+        self.assertTrue(notifications['1'].successful)
+        self.assertEqual(TEXT_TYPE, notifications['1'].type)
+        self.assertFalse(notifications['2'].successful)
+        self.assertTrue(db.session.query(Sample).get('1').text_notified)
+        self.assertFalse(db.session.query(Sample).get('2').text_notified)
@@ -0,0 +1,75 @@
+import smtplib
+
+from tests.base_test import BaseTest
+from tests.fakes import FakeClock, FakeServer
+
+from communicator.services.smtp_pool import SmtpConnectionPool
+
+
+class TestSmtpConnectionPool(BaseTest):
+
+    def get_pool(self, **kwargs):
+        self.servers = []
+        self.clock = FakeClock()
+        return SmtpConnectionPool(lambda: self.servers.append(FakeServer()) or self.servers[-1],
+                                  clock=self.clock, **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.get_pool()
+        for i in range(5):
+            pool.send(lambda server: server.sendmail(f"message {i}"))
+        self.assertEqual(1, len(self.servers))
+        self.assertEqual(5, len(self.servers[0].sent))
+        self.assertEqual(0, self.servers[0].noops)
+
+    def test_idle_connections_are_checked_before_use(self):
+        pool = self.get_pool(probe_after=10)
+        pool.send(lambda server: server.sendmail("message 1"))
+        self.clock.now = 20
+        pool.send(lambda server: server.sendmail("message 2"))
+        self.assertEqual(1, len(self.servers))
+        self.assertEqual(1, self.servers[0].noops)
+
+        self.servers[0].alive = False  # Dropped by the relay while we weren't looking.
+        self.clock.now = 40
+        pool.send(lambda server: server.sendmail("message 3"))
+        self.assertEqual(2, len(self.servers))
+        self.assertTrue(self.servers[0].closed)
+        self.assertEqual(["message 3"], self.servers[1].sent)
+
+    def test_connections_are_recycled(self):
+        pool = self.get_pool(max_age=60, max_messages=3)
+        for i in range(4):
+            pool.send(lambda server: server.sendmail(f"message {i}"))
+        self.assertEqual(2, len(self.servers))
+        self.assertTrue(self.servers[0].closed)
+        self.clock.now = 60
+        pool.send(lambda server: server.sendmail("message 5"))
+        self.assertEqual(3, len(self.servers))
+        self.assertTrue(self.servers[1].closed)
+
+    def test_reconnects_and_resends_when_the_connection_drops(self):
+        pool = self.get_pool()
+        pool.send(lambda server: server.sendmail("message 1"))
+        self.servers[0].alive = False
+        pool.send(lambda server: server.sendmail("message 2"))
+        self.assertEqual(["message 2"], self.servers[1].sent)
+
+        def always_dropped(server):
+            raise smtplib.SMTPServerDisconnected()
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.send(always_dropped)  # Only tried twice, on the open connection, then a new one.
+        self.assertEqual(3, len(self.servers))
+        self.assertTrue(all(server.closed for server in self.servers))
+
+    def test_rejected_messages_keep_the_connection(self):
+        pool = self.get_pool()
+
+        def rejected(server):
+            raise smtplib.SMTPRecipientsRefused({'a@b.edu': (550, b'No such user')})
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            pool.send(rejected)
+        pool.send(lambda server: server.sendmail("message 1"))
+        self.assertEqual(1, len(self.servers))
+        pool.close()
+        self.assertTrue(self.servers[0].closed)